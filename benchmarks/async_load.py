@@ -0,0 +1,167 @@
+""" Load test of the sync and async runtimes against a stub Telegram Bot API.
+
+Seeds a scratch database (kyzma_bench) with users, starts a local stub that answers every
+Bot API method after --api-latency ms, pushes the same burst of command updates into each
+runtime and measures how long it takes until every reply has reached the stub.
+
+    MONGODB=mongodb://localhost:27017 python benchmarks/async_load.py --updates 2000
+    MONGODB=mongodb://localhost:27017 python benchmarks/async_load.py --commands balance,slot
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('ADMIN_ID', '999999999')
+
+from aiohttp import web
+from telebot import apihelper, asyncio_helper
+from telebot.types import Update
+
+from iter_users_rss import bench_database, seed
+
+TOKEN = '123456:bench'
+REPLY_METHODS = {'sendMessage', 'sendAnimation'}
+
+
+class StubTelegram:
+    """ Minimal Bot API: every method succeeds after a fixed latency; replies to users are counted """
+    def __init__(self, latency):
+        self.latency = latency
+        self.replies = 0
+        self.target = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    def start(self):
+        ready = threading.Event()
+        threading.Thread(target=self._serve, args=(ready,), daemon=True).start()
+        ready.wait()
+        api_url = f"http://127.0.0.1:{self.port}/bot{{0}}/{{1}}"
+        apihelper.API_URL = api_url
+        asyncio_helper.API_URL = api_url
+
+    def expect(self, count):
+        with self._lock:
+            self.replies = 0
+            self.target = count
+            self.done.clear()
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        app.router.add_get('/bot{token}/{method}', self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, request):
+        await asyncio.sleep(self.latency)
+        params = {**request.query, **(await request.post())}
+        chat_id = int(params.get('chat_id', 0))
+        if request.match_info['method'] in REPLY_METHODS and chat_id != int(os.environ['ADMIN_ID']):
+            with self._lock:
+                self.replies += 1
+                if self.target is not None and self.replies >= self.target:
+                    self.done.set()
+        result = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        return web.Response(text=json.dumps({'ok': True, 'result': result}), content_type='application/json')
+
+
+def synthetic_updates(count, users, commands):
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = random.randint(1, users)
+        updates.append(Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"user{user_id}"},
+                'text': '/' + random.choice(commands),
+            },
+        }))
+    return updates
+
+
+def run_sync(stub, telegram, updates):
+    stub.expect(len(updates))
+    started = time.perf_counter()
+    telegram.bot.process_new_updates(updates)
+    stub.done.wait()
+    return time.perf_counter() - started
+
+
+def run_async(stub, runtime, updates):
+    async def burst():
+        stub.expect(len(updates))
+        started = time.perf_counter()
+        await runtime.bot.process_new_updates(updates)
+        await asyncio.get_running_loop().run_in_executor(None, stub.done.wait)
+        elapsed = time.perf_counter() - started
+        await runtime.bot.close_session()
+        await runtime.database.close()
+        return elapsed
+    return asyncio.run(burst())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--commands', default='balance,farm,rank,slonyari')
+    parser.add_argument('--api-latency', type=float, default=50, help="stub Bot API latency in ms")
+    args = parser.parse_args()
+
+    stub = StubTelegram(args.api_latency / 1000)
+    stub.start()
+
+    from access_control import AccessControl
+    from async_runtime import AsyncRuntime
+    from handlers import Handlers
+    from router import Router
+    from scheduler import JobScheduler
+    from sharded_executor import ShardedExecutor
+    from telegram_client import TelegramClient
+
+    database = bench_database(async_pool=True)
+    executor = ShardedExecutor(int(os.getenv('BOT_SHARDS', 16)))
+    telegram = TelegramClient(TOKEN, executor)
+    handlers = Handlers(telegram.bot, database, JobScheduler(database))
+    router = Router(AccessControl(database))
+    handlers.setup_handlers(router)
+    router.register(telegram.bot)
+    commands = args.commands.split(',')
+
+    print(f"{args.updates} updates ({args.commands}), {args.users} users, stub latency {args.api_latency:g} ms")
+    for name in ('sync', 'async'):
+        seed(database, args.users)
+        database.user_cache.clear()
+        database.rebuild_ranking()
+        updates = synthetic_updates(args.updates, args.users, commands)
+        if name == 'sync':
+            elapsed = run_sync(stub, telegram, updates)
+        else:
+            runtime = AsyncRuntime(telegram, database, handlers, router, executor)
+            runtime.setup_handlers()
+            elapsed = run_async(stub, runtime, updates)
+        print(f"{name:>6}: {elapsed:.2f} s, {args.updates / elapsed:.0f} updates/s")
+
+    database.client.drop_database('kyzma_bench')
+
+
+if __name__ == '__main__':
+    main()
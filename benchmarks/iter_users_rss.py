@@ -0,0 +1,70 @@
+""" Peak RSS of loading every user into a list versus streaming them with iter_users.
+
+Seeds a scratch database (kyzma_bench) with N users and runs each strategy in a
+fresh subprocess so ru_maxrss reflects only that strategy.
+
+    MONGODB=mongodb://localhost:27017 python benchmarks/iter_users_rss.py 1000 10000 100000
+"""
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import MongoDB
+
+BENCH_DB = 'kyzma_bench'
+
+
+def bench_database(**kwargs):
+    """ A MongoDB bound to the scratch database, so the ledger, treasury and history writes land there too """
+    return MongoDB(db_name=BENCH_DB, **kwargs)
+
+
+def seed(database, count):
+    database.users_collection.drop()
+    batch = []
+    for user_id in range(1, count + 1):
+        batch.append({
+            'user_id': user_id, 'nickname': f"@user{user_id}", 'coins': user_id % 5000,
+            'last_farm_time': 0, 'access_level': 'user', 'debt': user_id % 7, 'debt_limit_reached': False,
+            'name': f"User {user_id}", 'deposit': user_id % 11, 'grechka': 0, 'party': None,
+        })
+        if len(batch) == 5000:
+            database.users_collection.insert_many(batch)
+            batch = []
+    if batch:
+        database.users_collection.insert_many(batch)
+
+
+def run(mode):
+    database = bench_database()
+    if mode == 'list':
+        users = [database._convert_id(user) for user in database.users_collection.find({})]
+        total = sum(user['coins'] for user in users)
+    else:
+        total = sum(user['coins'] for user in database.iter_users(projection={'_id': 0, 'coins': 1}))
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{peak_kb} {total}")
+
+
+def measure(mode):
+    output = subprocess.check_output([sys.executable, __file__, '--run', mode], text=True)
+    return int(output.split()[0]) / 1024
+
+
+def main(counts):
+    database = bench_database()
+    print(f"{'users':>10} {'list MiB':>10} {'stream MiB':>11}")
+    for count in counts:
+        seed(database, count)
+        print(f"{count:>10} {measure('list'):>10.1f} {measure('stream'):>11.1f}")
+    database.client.drop_database(BENCH_DB)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--run':
+        run(sys.argv[2])
+    else:
+        main([int(count) for count in sys.argv[1:]] or [1000, 10000, 100000])
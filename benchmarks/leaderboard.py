@@ -0,0 +1,53 @@
+""" Latency of /slonyari and /goys: full scan plus Python sort versus indexed sort().limit().
+
+    MONGODB=mongodb://localhost:27017 python benchmarks/leaderboard.py 10000 100000 500000
+"""
+import heapq
+import sys
+import time
+
+from iter_users_rss import BENCH_DB, bench_database, seed
+from indexes import IndexManager
+
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def full_scan(database, field, filter):
+    users = [database._convert_id(user) for user in database.users_collection.find(filter)]
+    return sorted(users, key=lambda user: user[field], reverse=True)[:10]
+
+
+def streamed(database, field, filter):
+    users = database.iter_users(filter, {'_id': 0, 'nickname': 1, field: 1})
+    return heapq.nlargest(10, users, key=lambda user: user[field])
+
+
+def main(counts):
+    database = bench_database()
+    queries = {
+        'coins': {'user_id': {'$nin': [None, 0]}},
+        'debt': {'debt': {'$gt': 0}, 'user_id': {'$ne': 0}},
+    }
+    print(f"{'users':>8} {'field':>6} {'full scan ms':>13} {'streamed ms':>12} {'indexed ms':>11}")
+    for count in counts:
+        seed(database, count)
+        IndexManager(database).ensure_indexes()
+        for field, filter in queries.items():
+            assert [u[field] for u in full_scan(database, field, filter)] == \
+                [u[field] for u in database.top_users(field, filter)]
+            print(f"{count:>8} {field:>6} "
+                  f"{best_of(lambda: full_scan(database, field, filter)):>13.2f} "
+                  f"{best_of(lambda: streamed(database, field, filter)):>12.2f} "
+                  f"{best_of(lambda: database.top_users(field, filter)):>11.2f}")
+    database.client.drop_database(BENCH_DB)
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [10000, 100000, 500000])
@@ -0,0 +1,50 @@
+""" Cost of resolving a roulette bet slip: the old per-bet list building and `in` checks, one
+call per bet, versus one lookup per bet in the precomputed payout tables.
+
+    python benchmarks/roulette_slip.py 1 5 10
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from games.roulette import WHEEL, Roulette
+
+# Colours and numbers only, the bet types the old code knew, so both sides resolve the same slip
+SLIP = [('красный', 100), ('7', 10), ('17', 10), ('черный', 50), ('23', 30),
+        ('0', 30), ('красный', 20), ('36', 40), ('5', 5), ('черный', 15)]
+
+
+def legacy_bet(bet_type, bet_amount, result):
+    """ One bet resolved the way roulette_game did before slips """
+    red_numbers = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
+    black_numbers = [2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35]
+    if bet_type == "красный" and result in red_numbers:
+        return bet_amount
+    elif bet_type == "черный" and result in black_numbers:
+        return bet_amount
+    elif bet_type.isdigit() and int(bet_type) == result:
+        return bet_amount * 35
+    return -bet_amount
+
+
+def main(sizes, number=20000):
+    roulette = Roulette(bot=None, database=None)
+    results = [random.randrange(37) for _ in range(number)]
+    print(f"{'bets':>5} {'legacy us':>10} {'tables us':>10} {'parse+tables us':>16}")
+    for size in sizes:
+        slip = SLIP[:size]
+        text = " ".join(f"{amount} {target}" for target, amount in slip).split()
+        legacy = timeit.timeit(lambda: [sum(legacy_bet(t, a, r) for t, a in slip) for r in results], number=1)
+        tables = timeit.timeit(lambda: [sum(roulette.resolve(slip, r)) for r in results], number=1)
+        parsed = timeit.timeit(lambda: [sum(roulette.resolve(roulette.parse_bets(text)[0], r)) for r in results], number=1)
+        per_slip = 1e6 / number
+        assert [sum(legacy_bet(t, a, r) for t, a in slip) for r in WHEEL] == [sum(roulette.resolve(slip, r)) for r in WHEEL]
+        print(f"{size:>5} {legacy * per_slip:>10.2f} "
+              f"{tables * per_slip:>10.2f} {parsed * per_slip:>16.2f}")
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1, 5, 10])
@@ -0,0 +1,48 @@
+""" Throughput of concurrent budget income: $inc on the single budget account versus the striped
+treasury. That no increment is lost is covered by tests/test_treasury.py.
+
+    MONGODB=mongodb://localhost:27017 python benchmarks/treasury_stripes.py 16 2000
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+from iter_users_rss import BENCH_DB, bench_database
+from treasury import Treasury
+
+
+def hammer(add, threads, per_thread):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(lambda: [add(1) for _ in range(per_thread)]) for _ in range(threads)]:
+            future.result()
+    return time.perf_counter() - started
+
+
+def main(threads, per_thread):
+    database = bench_database()
+    treasury = database.treasury
+    expected = threads * per_thread
+
+    database.users_collection.drop()
+    database.users_collection.insert_one({'user_id': Treasury.ACCOUNT, 'nickname': '@budget', 'coins': 0})
+    single = hammer(lambda amount: database.apply_delta(Treasury.ACCOUNT, {'coins': amount}), threads, per_thread)
+    database.user_cache.pop(Treasury.ACCOUNT)
+    single_total = database.find_user_id(Treasury.ACCOUNT)['coins']
+
+    database.users_collection.update_one({'user_id': Treasury.ACCOUNT}, {'$set': {'coins': 0}})
+    database.user_cache.pop(Treasury.ACCOUNT)
+    treasury.collection.drop()
+    striped = hammer(lambda amount: treasury.add(amount, 'bench'), threads, per_thread)
+    striped_total = treasury.total()
+
+    print(f"{threads} threads x {per_thread} increments, {treasury.stripes} stripes")
+    print(f"{'counter':>8} {'total':>8} {'seconds':>8} {'inc/s':>8}")
+    print(f"{'single':>8} {single_total:>8} {single:>8.2f} {expected / single:>8.0f}")
+    print(f"{'striped':>8} {striped_total:>8} {striped:>8.2f} {expected / striped:>8.0f}")
+    database.client.drop_database(BENCH_DB)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [16, 2000]))
@@ -0,0 +1,117 @@
+""" Local load harness for webhook mode: POSTs synthetic Telegram updates and reports throughput and latency.
+
+Without --url it starts an in-process WebhookServer that dispatches to per-user shards like the bot,
+with handlers that only sleep for --handler-ms, so ingestion can be measured without Telegram. With --url it targets a running bot
+(BOT_MODE=webhook); point apihelper.API_URL at a stub if outbound calls must stay local.
+
+    python benchmarks/webhook_load.py --updates 5000 --concurrency 32 --duplicates 0.05
+    python benchmarks/webhook_load.py --url http://127.0.0.1:8443/telegram --secret s3cret
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+def synthetic_update(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"load{user_id}"},
+            'text': random.choice(['/balance', '/slonyari', '/farm', 'привет']),
+        },
+    }
+
+
+def post(url, secret, update):
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def start_local_server(handler_ms, port):
+    os.environ.setdefault('WEBHOOK_HOST', '127.0.0.1')
+    os.environ['WEBHOOK_PORT'] = str(port)
+    from sharded_executor import ShardedExecutor, sender_id
+    from webhook import WebhookServer
+
+    executor = ShardedExecutor(int(os.getenv('BOT_SHARDS', 16)), name="update-shard")
+
+    def process(updates):
+        for update in updates:
+            executor.submit(sender_id(update), time.sleep, handler_ms / 1000)
+
+    server = WebhookServer(None, process=process)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, executor, f"http://127.0.0.1:{server.httpd.server_address[1]}{server.path}"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET'))
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--duplicates', type=float, default=0.0, help="fraction of updates sent twice")
+    parser.add_argument('--handler-ms', type=float, default=20)
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    server, executor, url = (None, None, args.url) if args.url else start_local_server(args.handler_ms, args.port)
+    updates = [synthetic_update(update_id, random.randint(1, args.users)) for update_id in range(1, args.updates + 1)]
+    updates += random.sample(updates, int(len(updates) * args.duplicates))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda update: post(url, args.secret, update), updates))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for _, latency in results]
+    print(f"POSTed {len(updates)} updates in {elapsed:.2f} s ({len(updates) / elapsed:.0f} req/s), statuses {statuses}")
+    print(f"HTTP latency p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+
+    if server:
+        stats = server.stats()
+        while stats['processed'] < stats['received'] - stats['duplicates'] - stats['rejected']:
+            time.sleep(0.05)
+            stats = server.stats()
+        while sum(shard['processed'] for shard in executor.stats()) < stats['processed']:
+            time.sleep(0.05)
+        total = time.perf_counter() - started
+        print(f"Processed {stats['processed']} updates in {total:.2f} s ({stats['processed'] / total:.0f} updates/s)")
+        print(f"Dropped duplicates {stats['duplicates']}, rejected (queue full) {stats['rejected']}")
+        print(f"Queue-to-shard latency avg {stats['avg_latency_ms']:.1f} ms, max {stats['max_latency_ms']:.1f} ms")
+        print(executor.summary())
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+from os import getenv
+from cache import TTLCache
+
+
+class AccessControl:
+    """ Access levels kept in memory with a TTL, so an admin command check is a dict lookup.
+    Users without a document are cached as unknown for a shorter TTL and answered without a query """
+    LEVELS = ('owner', 'admin', 'user')
+
+    def __init__(self, database):
+        self.database = database
+        max_entries = int(getenv('ACCESS_CACHE_MAX_ENTRIES', 10000))
+        self.levels = TTLCache(max_entries, float(getenv('ACCESS_CACHE_TTL', 300)))
+        self.unknown = TTLCache(max_entries, float(getenv('ACCESS_NEGATIVE_TTL', 60)))
+
+    def check(self, message, levels):
+        """ Whether the sender of message has one of levels. Returns boolean """
+        return self.level(message.from_user.id) in levels
+
+    def level(self, user_id):
+        """ Access level of the user. Returns 'owner', 'admin', 'user' or None for unknown users """
+        level = self.levels.get(user_id)
+        if level is not None:
+            return level
+        if self.unknown.get(user_id):
+            return None
+
+        user = self.database.users_collection.find_one({'user_id': user_id}, {'_id': 0, 'access_level': 1})
+        if user is None:
+            self.unknown.put(user_id, True)
+            return None
+        level = user.get('access_level', 'user')
+        self.levels.put(user_id, level)
+        return level
+
+    def set_level(self, user_id, level):
+        """ Store a new access level and make it effective at once """
+        self.database.update_user(user_id, {'access_level': level})
+        self.invalidate(user_id)
+        self.levels.put(user_id, level)
+
+    def invalidate(self, user_id):
+        self.levels.pop(user_id)
+        self.unknown.pop(user_id)
+
+    def stats(self):
+        """ Access cache usage report. Returns string """
+        stats = self.levels.stats()
+        return (
+            f"Access levels: {stats['entries']} cached, {stats['hit_rate']:.0%} hit rate, "
+            f"{self.unknown.stats()['entries']} unknown users cached"
+        )
@@ -1,43 +1,29 @@
 from bot.bot_commands import admin_bot_commands
 from bot.bot_replies import bot_replies
 from os import getenv
-from database import MongoDB
-import telebot
-
-class AccessLevel(telebot.custom_filters.AdvancedCustomFilter):  
-    key='access_level'
-    print("check1")
-    @staticmethod
-    def check(message, levels):
-        print("check2")
-        access_level = MongoDB().get_access_level(message.from_user.id)
-        print(access_level)
-        return access_level in levels
-        
 
 class AdminHandler:
-    def __init__(self, bot):
-        self.bot = bot
-        self.database = MongoDB()
+    def __init__(self, telegram, database, broadcaster, access, scheduler):
+        self.telegram = telegram
+        self.access = access
+        self.scheduler = scheduler
+        self.bot = telegram.bot
+        self.database = database
+        self.broadcaster = broadcaster
+        self.broadcaster.register('text', lambda job, user: job['text'])
         self.bot_commands = admin_bot_commands
         self.bot_replies = bot_replies
         self.owner = getenv("ADMIN_ID")
-        self.budget = 5587251063
 
     def give_all_users_1000_coins(self, message):
         """Give 1000 coins to all users."""
-        users = self.database.find_users()
-        chat_id = message.chat.id
-
-        for user in users:
-            updated_user = {"coins": user["coins"] + 1000}
-            self.database.update_user(user["user_id"], updated_user)
-
-        self.bot.send_message(chat_id, self.bot_replies['rozdacha'], parse_mode="HTML")
+        report = self.database.inc_all_users("rozdacha", {"coins": 1000})
+        self.bot.send_message(message.chat.id, self.bot_replies['rozdacha'], parse_mode="HTML")
+        self.bot.send_message(self.owner, report.summary())
 
     def all_users(self, message):
         """Get all users."""
-        users = self.database.find_users()
+        users = self.database.iter_users(projection={"_id": 0, "nickname": 1, "coins": 1})
         response_message = ""
         for index, user in enumerate(users, start=1):
             response_message += f"{index}. {user['nickname']} - {user['coins']} coins\n"
@@ -56,10 +42,12 @@ class AdminHandler:
             self.bot.reply_to(message, "Пользователь не найден.")
             return
 
+        # The budget account's coins live partly in the treasury stripes
+        coins = self.database.treasury.total() if user['user_id'] == self.database.treasury.ACCOUNT else user['coins']
         response_message = (
             f"Nickname: {user['nickname']}\n"
             f"ID: {user['user_id']}\n"
-            f"Coins: {user['coins']}\n"
+            f"Coins: {coins}\n"
             f"Last farm time: {user['last_farm_time']}\n"
             f"Access level: {user['access_level']}\n"
             f"Debt: {user['debt']}\n"
@@ -82,8 +70,7 @@ class AdminHandler:
                 self.bot.reply_to(message, "Пользователь не найден.")
                 return
 
-            user["coins"] += amount
-            self.database.update_user(user["user_id"], user)
+            self.database.apply_delta(user["user_id"], {"coins": amount}, reason="admin_give")
             self.bot.reply_to(message, f"Вы успешно дали {amount} монет пользователю {nickname}.")
         except ValueError:
             self.bot.reply_to(message, "Сумма должна быть числом.")
@@ -103,12 +90,8 @@ class AdminHandler:
                 self.bot.reply_to(message, "Пользователь не найден.")
                 return
 
-            budget = self.database.find_user_id(self.budget)
-
-            user["coins"] -= amount
-            budget["coins"] += amount
-            self.database.update_user(user["user_id"], user)
-            self.database.update_user(self.budget, budget)
+            self.database.apply_delta(user["user_id"], {"coins": -amount}, reason="admin_remove")
+            self.database.treasury.add(amount, "admin_remove")
             self.bot.reply_to(message, f"Вы успешно забрали {amount} монет у пользователя {nickname}.")
         except ValueError:
             self.bot.reply_to(message, "Сумма должна быть числом.")
@@ -120,16 +103,8 @@ class AdminHandler:
             self.bot.reply_to(message, "Неверный формат. Используйте: /send_message <message>")
             return
 
-        user_message = parts[1]
-        users = self.database.find_users()
-
-        for user in users:
-            try:
-                self.bot.send_message(user["user_id"], user_message)
-            except Exception as e:
-                print(f"Failed to send message to {user['nickname']}: {e}")
-
-        self.bot.reply_to(message, "Сообщение отправлено всем пользователям.")
+        job_id = self.broadcaster.start('text', text=parts[1])
+        self.bot.reply_to(message, f"Рассылка {job_id} запущена. Прогресс придёт в лог администратора.")
 
     def send_message_to_one_user(self, message):
         """Send a custom message to a specific user by nickname."""
@@ -168,44 +143,91 @@ class AdminHandler:
         except Exception as e:
             self.bot.reply_to(message, f"Помылка: {e}")
             
+    def show_pool_stats(self, message):
+        """Show MongoDB connection pool usage."""
+        self.bot.send_message(message.chat.id, self.database.pool_stats())
+
+    def show_telegram_stats(self, message):
+        """Show Telegram API call counts and latency per method."""
+        self.bot.send_message(message.chat.id, self.telegram.stats())
+
+    def show_shard_stats(self, message):
+        """Show queue depth and latency of every update shard."""
+        self.bot.send_message(message.chat.id, self.telegram.executor.summary())
+
+    def show_cache_stats(self, message):
+        """Show user cache usage."""
+        self.bot.send_message(message.chat.id, self.database.cache_stats() + "\n" + self.access.stats())
+
+    def show_jobs(self, message):
+        """Show scheduled jobs with their last run and duration."""
+        self.bot.send_message(message.chat.id, self.scheduler.summary())
+
+    def set_access_level(self, message):
+        """Change a user's access level."""
+        parts = message.text.split()
+        if len(parts) != 3 or parts[2] not in self.access.LEVELS:
+            self.bot.reply_to(message, f"Неверный формат. Используйте: /set_level <nickname> <{'/'.join(self.access.LEVELS)}>")
+            return
+
+        nickname, level = parts[1], parts[2]
+        user = self.database.find_user_nickname(nickname)
+        if user is None:
+            self.bot.reply_to(message, "Пользователь не найден.")
+            return
+
+        self.access.set_level(user['user_id'], level)
+        self.bot.reply_to(message, f"Уровень доступа {nickname}: {level}.")
+
+    def audit_user(self, message):
+        """Compare a user's balances with the ones rebuilt from the ledger."""
+        parts = message.text.split()
+        if len(parts) != 2:
+            self.bot.reply_to(message, "Неверный формат. Используйте: /audit <nickname>")
+            return
+
+        user = self.database.find_user_nickname(parts[1])
+        if user is None:
+            self.bot.reply_to(message, "Пользователь не найден.")
+            return
+
+        self.database.ledger.flush()
+        rebuilt = self.database.ledger.balance(user['user_id'])
+        if rebuilt is None:
+            self.bot.reply_to(message, "Журнал не покрывает этого пользователя.")
+            return
+
+        lines = [f"{user['nickname']}: stored / ledger"]
+        for field, amount in rebuilt.items():
+            stored = user.get(field) or 0
+            if field == 'coins' and user['user_id'] == self.database.treasury.ACCOUNT:
+                stored = self.database.treasury.total()
+            lines.append(f"{field}: {stored} / {amount}{'' if stored == amount else ' ⚠️'}")
+        lines.append(self.database.ledger.stats())
+        self.bot.send_message(message.chat.id, "\n".join(lines))
+
     def show_budjet(self, message):
-        budget = self.database.find_user_id(self.budget)
-        response_message = f"Бюджет: {budget['coins']} coins"
+        response_message = f"Бюджет: {self.database.treasury.total()} coins"
         self.bot.send_message(message.chat.id, response_message)
         
-    def setup_admin_handler(self):
-        @self.bot.message_handler(commands=["rozdacha"])
-        def rozdacha_handler(message):
-            self.give_all_users_1000_coins(message)
-
-        @self.bot.message_handler(commands=["all"], access_level=['owner'])
-        def all_users_handler(message):
-            self.all_users(message)
-
-        @self.bot.message_handler(commands=["find"], access_level=['owner'])
-        def find_user_handler(message):
-            self.get_user(message)
-
-        @self.bot.message_handler(commands=["give"], access_level=['owner'])
-        def give_coins_handler(message):
-            self.give_coins(message)
-
-        @self.bot.message_handler(commands=["remove"], access_level=['owner'])
-        def remove_coins_handler(message):
-            self.remove_coins(message)
-            
-        @self.bot.message_handler(commands=['send_all'], access_level=['owner'])
-        def send_all(message):
-            self.send_message_to_users(message)
-            
-        @self.bot.message_handler(commands=["send"], access_level=['owner'])
-        def send_message_to_user_handler(message):
-            self.send_message_to_one_user(message)
-            
-        @self.bot.message_handler(commands=['mafia'], access_level=['owner', 'admin'])
-        def send_to_mafia(message):
-            self.send_message_to_mafia(message)
-            
-        @self.bot.message_handler(commands=['budget'], access_level=['owner', 'admin'])
-        def show_budget(message):
-            self.show_budjet(message)
\ No newline at end of file
+    def setup_admin_handler(self, router):
+        owner_commands = {
+            'all': self.all_users,
+            'find': self.get_user,
+            'give': self.give_coins,
+            'remove': self.remove_coins,
+            'send_all': self.send_message_to_users,
+            'send': self.send_message_to_one_user,
+            'pool': self.show_pool_stats,
+            'cache': self.show_cache_stats,
+            'tgstats': self.show_telegram_stats,
+            'shards': self.show_shard_stats,
+            'set_level': self.set_access_level,
+            'jobs': self.show_jobs,
+            'audit': self.audit_user,
+        }
+        for command, handler in owner_commands.items():
+            router.command(command, handler, access_level=['owner'])
+        router.command('rozdacha', self.give_all_users_1000_coins)
+        router.command('mafia', self.send_message_to_mafia, access_level=['owner', 'admin'])
+        router.command('budget', self.show_budjet, access_level=['owner', 'admin'])
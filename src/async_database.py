@@ -0,0 +1,60 @@
+from pymongo import AsyncMongoClient, ReturnDocument
+from os import getenv
+
+
+class AsyncMongoDB:
+    """ asyncio access to the users collection for the async runtime. Shares the user cache and
+    the ranking with the synchronous MongoDB, so writes from either runtime stay visible to both.
+    Its pool is the async share of MONGODB_MAX_POOL_SIZE, see MongoDB """
+    def __init__(self, database):
+        if not database.async_pool_size:
+            raise ValueError("AsyncMongoDB needs a MongoDB created with async_pool=True")
+        self.database = database
+        self.client = AsyncMongoClient(
+            getenv('MONGODB'),
+            maxPoolSize=database.async_pool_size,
+            minPoolSize=int(getenv('MONGODB_MIN_POOL_SIZE', 0)),
+            maxIdleTimeMS=int(getenv('MONGODB_MAX_IDLE_TIME_MS', 300000)),
+            waitQueueTimeoutMS=int(getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+            connectTimeoutMS=int(getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+            serverSelectionTimeoutMS=int(getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            event_listeners=[database.async_pool_monitor],
+        )
+        self.db = self.client[database.db.name]
+        self.users_collection = self.db[database.users_collection.name]
+        self.user_cache = database.user_cache
+        self.ranking = database.ranking
+        self.treasury = database.treasury
+        self.treasury_collection = self.db[database.treasury.collection.name]
+
+    async def find_user_id(self, user_id):
+        """ Find user by user_id. Returns user dictionary or None """
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = await self.users_collection.find_one({"user_id": user_id})
+            if not user:
+                return None
+            user = self.database._cache_user(self.database._convert_id(user))
+        return dict(user)
+
+    async def apply_delta(self, user_id, deltas, conditions=None, set_fields=None, reason=None, entry_id=None):
+        """ Atomically apply $inc deltas and optional $set fields to a user whose document matches
+        conditions. Same contract as MongoDB.apply_delta. Returns updated user dictionary or None """
+        query = {"user_id": user_id}
+        if conditions:
+            query.update(conditions)
+        update = {"$inc": {**deltas, "version": 1}}
+        if set_fields:
+            update["$set"] = set_fields
+        user = await self.users_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if not user:
+            return None
+        return self.database._after_delta(user_id, user, deltas, reason, entry_id)
+
+    async def add_to_treasury(self, amount, reason):
+        """ Add amount to a random treasury stripe, see Treasury.add """
+        await self.treasury_collection.update_one(*self.treasury.increment(amount), upsert=True)
+        self.database.ledger.record(self.treasury.ACCOUNT, {'coins': amount}, reason)
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,182 @@
+from os import getenv
+import asyncio
+import queue
+import time
+
+from async_database import AsyncMongoDB
+
+
+class AsyncRuntime:
+    """ asyncio runtime: the hot commands run as coroutines on one event loop over AsyncTeleBot and
+    AsyncMongoDB, so thousands of in-flight updates share a single thread. Every other update is
+    handed to the synchronous handlers of sync_bot on the executor's shards, unless the router
+    has no route for it. Each user's updates are handled one at a time, in arrival order """
+    def __init__(self, telegram, database, handlers, router, executor):
+        self.bot = telegram.async_bot()
+        self.sync_bot = telegram.bot
+        self.router = router
+        self.database = AsyncMongoDB(database)
+        self.handlers = handlers
+        self.bank = handlers.bank
+        self.farm = handlers.farm
+        self.slots = handlers.slots
+        self.bot_replies = handlers.bot_replies
+        self.executor = executor
+        self.shard_retry = float(getenv("BOT_SHARD_RETRY", 0.05))
+        self.user_locks = {}
+        self.delayed = set()
+
+    def run(self):
+        """ Poll Telegram on the event loop until interrupted """
+        self.setup_handlers()
+        asyncio.run(self._poll())
+
+    async def _poll(self):
+        try:
+            await self.bot.infinity_polling(skip_pending=True)
+        finally:
+            await self.bot.close_session()
+            await self.database.close()
+
+    async def run_sync(self, key, function, *args):
+        """ Run a blocking function on the shard of key. While the shard is full the caller
+        waits here instead of blocking the event loop; ordered() keeps one user's calls in order """
+        while True:
+            try:
+                future = self.executor.submit_nowait(key, function, *args)
+                break
+            except queue.Full:
+                await asyncio.sleep(self.shard_retry)
+        return await asyncio.wrap_future(future)
+
+    def later(self, delay, function, *args):
+        """ Await function(*args) after delay seconds without holding up the calling handler """
+        async def call():
+            await asyncio.sleep(delay)
+            try:
+                await function(*args)
+            except Exception as e:
+                print(f"Delayed call {function.__name__} failed: {e}")
+        task = asyncio.create_task(call())
+        self.delayed.add(task)
+        task.add_done_callback(self.delayed.discard)
+
+    def ordered(self, handler):
+        """ Wrap a handler so that one user's updates run one at a time, in arrival order """
+        async def run(update):
+            user_id = update.from_user.id
+            entry = self.user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await handler(update)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.user_locks[user_id]
+        return run
+
+    def log(self, message):
+        self.handlers.log(message)
+
+    async def balance(self, message):
+        user = await self.database.find_user_id(message.from_user.id)
+        if user is None:
+            await self.bot.reply_to(message, self.bot_replies['error_database'])
+            return
+        settlement = self.bank.settlement(user, time.time())
+        if settlement is not None:
+            user = await self.database.apply_delta(user['user_id'], *settlement, reason='interest', entry_id=self.bank.interest_entry_id(user)) or await self.database.find_user_id(user['user_id'])
+        await self.bot.reply_to(message, self.bank.balance_message(user))
+
+    async def top_users(self, message):
+        if self.handlers.database.ranking.ready:
+            text = self.handlers.top_users_message()
+        else:
+            text = await self.run_sync(message.from_user.id, self.handlers.top_users_message)
+        await self.bot.reply_to(message, text)
+        self.log(f"User {message.from_user.username} used /top")
+
+    async def debtors(self, message):
+        if self.handlers.database.ranking.ready:
+            text = self.handlers.debtors_message()
+        else:
+            text = await self.run_sync(message.from_user.id, self.handlers.debtors_message)
+        await self.bot.send_message(message.chat.id, text)
+        self.log(f"User {message.from_user.username} used /goys")
+
+    async def rank(self, message):
+        await self.bot.reply_to(message, self.handlers.rank_message(message.from_user.id))
+
+    async def farm_coin(self, message):
+        """ /farm with the same rules as Farm.farm_coin """
+        current_time = time.time()
+        remaining_time = self.farm.cooldowns.remaining(message.from_user.id, current_time)
+        if remaining_time > 0:
+            await self.bot.reply_to(message, self.farm.cooldown_message(remaining_time))
+            return
+
+        user = await self.database.find_user_id(message.from_user.id)
+        if user is None:
+            await self.bot.reply_to(message, self.bot_replies['error_database'])
+            return
+
+        remaining_time = self.farm.remaining(user, current_time)
+        if remaining_time > 0:
+            await self.bot.reply_to(message, self.farm.cooldown_message(remaining_time))
+            return
+
+        coins, coins_tax, coins_after_tax = self.farm.harvest()
+        user = await self.database.apply_delta(user['user_id'], *self.farm.delta(coins_after_tax, current_time), reason='farm')
+        if user is None:
+            await self.bot.reply_to(message, "Вы уже фармили в этом часе.")
+            return
+        self.farm.cooldowns.start(user['user_id'], current_time, current_time)
+        await self.database.add_to_treasury(coins_tax, 'farm_tax')
+        await self.bot.reply_to(message, self.farm.result_message(coins, coins_tax, coins_after_tax, user['coins']))
+        self.log(f"{coins_tax} added to budget.")
+        self.log(f"User {message.from_user.username} farmed coins.\n\nTotal: {user['coins']}")
+
+    async def slot_machine(self, message):
+        """ /slot with the same rules as Slots.slot_machine """
+        user = await self.database.find_user_id(message.from_user.id)
+        if user is None:
+            await self.bot.reply_to(message, self.bot_replies['error_database'])
+            return
+        if user['coins'] <= 0:
+            await self.bot.send_animation(message.chat.id, 'https://i.giphy.com/media/v1.Y2lkPTc5MGI3NjExZXo5YWtjM3JxOXFhdnZ6eXgyN2s3NnR1ZzEzNXhiczQ2MWw0ODQ1ZyZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/ytdPUwmGshqsJqZhET/giphy-downsized-large.gif')
+            return
+
+        await self.bot.send_dice(message.chat.id, emoji="🎰")
+
+        results, amount = self.slots.spin()
+        user = await self.database.apply_delta(user['user_id'], *self.slots.delta(amount), reason='slots')
+        if user is None:
+            await self.bot.reply_to(message, self.bot_replies['error_database' if amount > 0 else 'error_no_coins'])
+            return
+        self.later(self.slots.reveal_delay, self.bot.reply_to, message, self.slots.result_message(results, amount, user['coins']))
+        self.log(f"User {message.from_user.username} played slots.")
+
+    async def fallback_message(self, message):
+        if self.router.resolve(message) is None:
+            self.router.unrouted += 1
+            return
+        await self.run_sync(message.from_user.id, self.sync_bot.process_new_messages, [message])
+
+    async def fallback_callback_query(self, call):
+        await self.run_sync(call.from_user.id, self.sync_bot.process_new_callback_query, [call])
+
+    def setup_handlers(self):
+        """ Register the async hot commands, then hand everything else to the sync handlers """
+        hot_commands = {
+            'balance': self.balance,
+            'slonyari': self.top_users,
+            'goys': self.debtors,
+            'rank': self.rank,
+            'farm': self.farm_coin,
+            'slot': self.slot_machine,
+        }
+        for command, handler in hot_commands.items():
+            self.bot.register_message_handler(self.ordered(handler), commands=[command])
+        self.bot.register_message_handler(self.ordered(self.fallback_message), func=lambda message: True)
+        self.bot.register_callback_query_handler(self.ordered(self.fallback_callback_query), func=lambda call: True)
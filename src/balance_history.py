@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+from os import getenv
+import threading
+import time
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from bulk import BulkWriter
+
+HISTORY_FIELDS = ('coins', 'deposit', 'debt')
+SPARKS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values):
+    """ Render numbers as a row of block characters scaled between their minimum and maximum """
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARKS[len(SPARKS) // 2] * len(values)
+    return "".join(SPARKS[round((value - low) / (high - low) * (len(SPARKS) - 1))] for value in values)
+
+
+class BalanceHistory:
+    """ Hourly balance samples in day buckets: one document per user per UTC day holding a
+    24-slot array per field, so a month of history is at most ~30 documents. Samples are kept
+    in memory, the latest per user and hour, and written in batches by a flush thread """
+    def __init__(self, database):
+        self.database = database
+        self.collection = database.db['balance_history']
+        self.writer = BulkWriter(self.collection, batch_size=int(getenv('BULK_BATCH_SIZE', 1000)))
+        self.flush_interval = float(getenv('BALANCE_HISTORY_FLUSH_INTERVAL', 60))
+        self._samples = {}
+        # Buckets known to exist with their arrays, so only a day's first flush preallocates
+        self._buckets = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="balance-history", daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, fields, now=None):
+        """ Sample the history fields present in fields, e.g. a user document after a write """
+        values = {field: fields[field] for field in HISTORY_FIELDS if fields.get(field) is not None}
+        if not values:
+            return
+        now = now or datetime.now(timezone.utc)
+        key = (user_id, now.strftime('%Y-%m-%d'), now.hour)
+        with self._lock:
+            self._samples.setdefault(key, {}).update(values)
+
+    def flush(self):
+        """ Write every buffered sample. Returns BulkReport or None if nothing was buffered """
+        with self._flush_lock:
+            with self._lock:
+                samples, self._samples = self._samples, {}
+            if not samples:
+                return None
+            days = {(user_id, day) for user_id, day, _ in samples} - self._buckets
+            oldest = min(day for _, day, _ in samples)
+            if days:
+                empty = {field: [None] * 24 for field in HISTORY_FIELDS}
+                report = self.writer.write("balance history buckets", (
+                    UpdateOne({'_id': f"{user_id}:{day}"}, {'$setOnInsert': {'user_id': user_id, 'day': day, **empty}}, upsert=True)
+                    for user_id, day in days
+                ))
+                if report.errors:
+                    print(f"Balance history lost {len(samples)} samples:\n{report.summary()}")
+                    return report
+            self._buckets = {bucket for bucket in self._buckets | days if bucket[1] >= oldest}
+            return self.writer.write("balance history", (
+                UpdateOne({'_id': f"{user_id}:{day}"}, {'$set': {f"{field}.{hour}": value for field, value in values.items()}})
+                for (user_id, day, hour), values in samples.items()
+            ))
+
+    def series(self, user_id, field, days, now=None):
+        """ The field's value at the end of each day of the last days, or of each of the last 24 hours
+        when days is 1, carrying the last sample over hours without one. Returns list of numbers, oldest first """
+        now = now or datetime.now(timezone.utc)
+        if days == 1:
+            points = [now - timedelta(hours=offset) for offset in range(23, -1, -1)]
+        else:
+            points = [now - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+        first = points[0].date()
+        range_days = [(first + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range((now.date() - first).days + 1)]
+        buckets = self.collection.find(
+            {'user_id': user_id, 'day': {'$gte': range_days[0]}}, {'_id': 0, 'day': 1, field: 1},
+        ).sort('day', ASCENDING)
+        hours_by_day = {bucket['day']: bucket.get(field) or [] for bucket in buckets}
+        # The range starts from the last sample before it, if any
+        before = self.collection.find_one(
+            {'user_id': user_id, 'day': {'$lt': range_days[0]}}, {'_id': 0, field: 1}, sort=[('day', DESCENDING)],
+        )
+        samples = [sample for sample in (before or {}).get(field) or [] if sample is not None]
+
+        # A point is taken after its hour's sample: every hour of the last 24, or the end of each day
+        if days == 1:
+            taken = {(point.strftime('%Y-%m-%d'), point.hour) for point in points}
+        else:
+            taken = {(day, 23) for day in range_days[:-1]} | {(range_days[-1], now.hour)}
+        values, last = [], samples[-1] if samples else None
+        for day in range_days:
+            hours = hours_by_day.get(day, [])
+            for hour in range(now.hour + 1 if day == range_days[-1] else 24):
+                if hour < len(hours) and hours[hour] is not None:
+                    last = hours[hour]
+                if (day, hour) in taken and last is not None:
+                    values.append(last)
+        return values
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Balance history flush failed: {e}")
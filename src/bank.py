@@ -1,31 +1,36 @@
 from bot.bot_replies import bot_replies
-import telebot
+from pymongo import UpdateOne
+import time
 from os import getenv
-from database import MongoDB
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.triggers.interval import IntervalTrigger
 
 class Bank:
-    def __init__(self):
+    def __init__(self, bot, database, log_sink, broadcaster, scheduler):
         self.bot_replies = bot_replies
-        self.bot = telebot.TeleBot(getenv("BOT_TOKEN"))
+        self.bot = bot
         self.admin_id = int(getenv("ADMIN_ID"))
-        self.database = MongoDB()
-        self.scheduler = BackgroundScheduler(jobstores={"default": MemoryJobStore()})
-        self.setup_scheduler()
+        self.database = database
+        self.log_sink = log_sink
+        self.broadcaster = broadcaster
+        self.broadcaster.register(
+            'debt_reminder',
+            self.render_debt_reminder,
+            filter=self.debt_reminder_filter,
+            projection={'nickname': 1, 'name': 1, 'debt': 1},
+            claim=self.claim_debt_reminder,
+            on_failed=self.release_debt_reminder,
+        )
+        self.annual_rate = 0.05
+        self.reminder_window = float(getenv("DEBT_REMINDER_WINDOW_HOURS", 12)) * 3600
+        self.setup_scheduler(scheduler)
                 
-    def setup_scheduler(self):
-        """ Setup the scheduler to apply hourly compound interest """
-        self.scheduler.add_job(self.apply_interest_to_all_users, 'interval', hours=1, replace_existing=True, id="interest_job")
-        self.scheduler.add_job(self.remind_debtors, 'interval', hours=12, replace_existing=True, id="debt_reminder_job")
-        self.scheduler.start()
+    def setup_scheduler(self, scheduler):
+        """ Schedule the debt reminders. Interest accrues lazily, see settle_interest """
+        scheduler.add("debt_reminder", self.remind_debtors, IntervalTrigger(hours=12))
 
     def log(self, message):
-        """ Log messages to the admin in bot chat """
-        try:
-            self.bot.send_message(self.admin_id, message)
-        except Exception as e:
-            print(f"Failed to log message: {e}")
+        """ Log messages to the admin in bot chat. Delivered in digests by the log sink """
+        self.log_sink.log(message)
 
     def calculate_hourly_compound_interest(self, principal, annual_rate, hours):
         try:
@@ -34,31 +39,112 @@ class Bank:
             n = 24
             t = hours / 24
             amount = principal * (1 + annual_rate / n) ** (n * t)
-            return max(round(amount), 0)  # Защита от отрицательных значений
+            return max(amount, 0)  # Защита от отрицательных значений
         except Exception as e:
-            self.bot.send_message(self.admin_id, f"Error in interest calculation: {e}")
+            self.log(f"Error in interest calculation: {e}")
             return principal
 
+    def accrue(self, principal, last_accrual_at, now):
+        """ Closed-form hourly compounding over the whole hours since last_accrual_at.
+        Returns (unrounded deposit, new last_accrual_at); the unfinished hour keeps counting """
+        hours = int((now - last_accrual_at) // 3600)
+        if principal <= 0 or hours <= 0:
+            return principal, last_accrual_at
+        deposit = self.calculate_hourly_compound_interest(principal, self.annual_rate, hours)
+        return deposit, last_accrual_at + hours * 3600
+
+    def settle_interest(self, user, now=None):
+        """ Settle interest accrued since the user's last_accrual_at into their deposit.
+        Called whenever the deposit is read or changed. Returns the up-to-date user dictionary """
+        settlement = self.settlement(user, now or time.time())
+        if settlement is None:
+            return user
+        updated_user = self.database.apply_delta(user['user_id'], *settlement, reason='interest', entry_id=self.interest_entry_id(user))
+        return updated_user or self.database.find_user_id(user['user_id'])
+
+    def interest_entry_id(self, user):
+        """ Ledger entry id of a settlement. Only one settlement from a given last_accrual_at can apply,
+        so a bulk and a lazy settlement racing over the same period are recorded once """
+        return f"interest:{user['user_id']}:{user.get('last_accrual_at')}"
+
+    def settlement(self, user, now):
+        """ apply_delta arguments (deltas, conditions, set_fields) that settle the user's interest,
+        or None if nothing is due """
+        principal = user.get('deposit', 0)
+        last_accrual_at = user.get('last_accrual_at')
+
+        if principal <= 0:
+            return None
+
+        if last_accrual_at is None:
+            # Deposits made before lazy accrual start their clock now
+            return {}, {'last_accrual_at': None}, {'last_accrual_at': now}
+
+        # Interest compounds on the unrounded deposit, so settling hourly or once gives the same result.
+        # Deposits from before deposit_exact, or changed without it, start from the rounded deposit
+        exact = user.get('deposit_exact')
+        if exact is None or round(exact) != principal:
+            exact = principal
+        exact, new_last_accrual_at = self.accrue(exact, last_accrual_at, now)
+        if new_last_accrual_at == last_accrual_at:
+            return None
+
+        # The condition makes a concurrent settlement of the same period a no-op
+        return (
+            {'deposit': round(exact) - principal},
+            {'deposit': principal, 'last_accrual_at': last_accrual_at},
+            {'last_accrual_at': new_last_accrual_at, 'deposit_exact': exact},
+        )
+
     def apply_interest_to_all_users(self):
+        """ Settle accrued interest for every depositor at once (used by /apply) """
         try:
-            users = self.database.find_users()
-            annual_rate = 0.05
-            for user in users:
-                user.setdefault('deposit', 0)
-                if user['deposit'] > 0:
-                    self.log(f"Before interest {user['nickname']}: {user['deposit']}")
-                    principal = user['deposit']
-                    new_amount = self.calculate_hourly_compound_interest(principal, annual_rate, 1)
-                    user['deposit'] = new_amount
-                    self.database.update_user(user['user_id'], user)
-                    self.log(f"After interest {user['nickname']}: {user['deposit']}")
+            users = self.database.iter_users(
+                {'deposit': {'$gt': 0}},
+                {'_id': 0, 'user_id': 1, 'deposit': 1, 'deposit_exact': 1, 'last_accrual_at': 1},
+            )
+            entries = []
+            report = self.database.bulk_update_users("interest", self._interest_requests(users, time.time(), entries), fields=('deposit',))
+            for user_id, deltas, entry_id, deposit in self._applied(entries):
+                self.database.ledger.record(user_id, deltas, 'interest', entry_id)
+                self.database.balance_history.record(user_id, {'deposit': deposit})
+            self.log(report.summary())
         except Exception as e:
-            self.bot.send_message(self.admin_id, f"Error in applying interest: {e}")
+            self.log(f"Error in applying interest: {e}")
+
+    def _interest_requests(self, users, now, entries):
+        """ Build one conditional settlement request per depositor, collecting its ledger entry,
+        new deposit and new last_accrual_at into entries """
+        for user in users:
+            settlement = self.settlement(user, now)
+            if settlement is None:
+                continue
+            deltas, conditions, set_fields = settlement
+            update = {'$set': set_fields, '$inc': {**deltas, 'version': 1}}
+            if deltas:
+                entries.append((
+                    user['user_id'], deltas, self.interest_entry_id(user),
+                    user['deposit'] + deltas['deposit'], set_fields['last_accrual_at'],
+                ))
+            yield UpdateOne({'user_id': user['user_id'], **conditions}, update)
+
+    def _applied(self, entries, chunk_size=1000):
+        """ The entries whose period was settled: failed requests and those whose conditions matched
+        nothing leave last_accrual_at behind. A lazy settlement from the same start also counts, as it
+        records the same entry id and only one of them is kept. Yields (user_id, deltas, entry_id, deposit) """
+        for start in range(0, len(entries), chunk_size):
+            chunk = entries[start:start + chunk_size]
+            users = self.database.iter_users(
+                {'user_id': {'$in': [entry[0] for entry in chunk]}}, {'_id': 0, 'user_id': 1, 'last_accrual_at': 1},
+            )
+            settled = {user['user_id']: user.get('last_accrual_at') for user in users}
+            for user_id, deltas, entry_id, deposit, last_accrual_at in chunk:
+                if (settled.get(user_id) or 0) >= last_accrual_at:
+                    yield user_id, deltas, entry_id, deposit
 
     def deposit_money(self, message):
         """ Deposit money into the user's deposit account """
         user_id = message.from_user.id
-        user = self.database.find_user_id(user_id) or {'coins': 0, 'deposit': 0}
 
         parts = message.text.split()
         if len(parts) != 2 or not parts[1].isdigit():
@@ -71,22 +157,25 @@ class Bank:
             self.bot.reply_to(message, "Сумма депозита должна быть больше нуля.")
             return
 
-        if user['coins'] < amount:
-            self.bot.reply_to(message, "У вас недостаточно средств для депозита.")
+        user = self.database.find_user_id(user_id)
+        if user is None:
+            self.bot.reply_to(message, self.bot_replies['error_database'])
             return
+        user = self.settle_interest(user)
 
-        # Deduct money from the user's coins and add to the deposit
-        user['coins'] -= amount
-        user['deposit'] += amount
+        # Deduct money from the user's coins and add to the deposit; an empty deposit starts its clock now
+        set_fields = {'last_accrual_at': time.time()} if user.get('deposit', 0) <= 0 else None
+        user = self.database.apply_delta(user_id, {'coins': -amount, 'deposit': amount, 'deposit_exact': amount}, {'coins': {'$gte': amount}}, set_fields, reason='deposit')
+        if user is None:
+            self.bot.reply_to(message, "У вас недостаточно средств для депозита.")
+            return
 
-        self.database.update_user(user_id, user)
         self.bot.reply_to(message, f"Вы успешно положили {amount} KyZmaCoin на депозит. Ваш текущий депозит: {user['deposit']} KyZmaCoin.")
         self.log(f"User @{message.from_user.username} deposited {amount} coins into their deposit")
 
     def withdraw_money(self, message):
         """ Withdraw money from the user's deposit account """
         user_id = message.from_user.id
-        user = self.database.find_user_id(user_id)
 
         parts = message.text.split()
         if len(parts) != 2 or not parts[1].isdigit():
@@ -99,22 +188,32 @@ class Bank:
             self.bot.reply_to(message, "Сумма вывода должна быть больше нуля.")
             return
 
-        if user['deposit'] < amount:
-            self.bot.reply_to(message, "У вас недостаточно средств на депозите.")
+        user = self.database.find_user_id(user_id)
+        if user is None:
+            self.bot.reply_to(message, self.bot_replies['error_database'])
             return
+        self.settle_interest(user)
 
         # Deduct money from the user's deposit and add to coins
-        user['deposit'] -= amount
-        user['coins'] += amount
+        user = self.database.apply_delta(user_id, {'deposit': -amount, 'deposit_exact': -amount, 'coins': amount}, {'deposit': {'$gte': amount}}, reason='withdraw')
+        if user is None:
+            self.bot.reply_to(message, "У вас недостаточно средств на депозите.")
+            return
 
-        self.database.update_user(user_id, user)
         self.bot.reply_to(message, f"Вы успешно сняли {amount} KyZmaCoin с депозита. Ваш текущий депозит: {user['deposit']} KyZmaCoin.")
         self.log(f"User @{message.from_user.username} withdrew {amount} coins from their deposit")
 
     def check_balance(self, message, user_id):
         """ Check the user's balance """
         user = self.database.find_user_id(user_id)
-        self.bot.reply_to(message, f"Банк: {user['coins']} KyZmaCoin\nДепозит: {user['deposit']} KyZmaCoin")
+        if user is None:
+            self.bot.reply_to(message, self.bot_replies['error_database'])
+            return
+        user = self.settle_interest(user)
+        self.bot.reply_to(message, self.balance_message(user))
+
+    def balance_message(self, user):
+        return f"Банк: {user['coins']} KyZmaCoin\nДепозит: {user['deposit']} KyZmaCoin"
 
     def borrow_money(self, message):
         user_id = message.from_user.id
@@ -135,13 +234,14 @@ class Bank:
             self.bot.reply_to(message, "Вы не можете взять такую сумму. Лимит долга: 1.000.000 KyZmaCoin.")
             return
 
-        user['coins'] += amount
-        user['debt'] += amount
+        user = self.database.apply_delta(user_id, {'coins': amount, 'debt': amount}, {'debt': {'$lte': 1_000_000 - amount}, 'debt_limit_reached': {'$ne': True}}, reason='borrow')
+        if user is None:
+            self.bot.reply_to(message, "Вы не можете взять такую сумму. Лимит долга: 1.000.000 KyZmaCoin.")
+            return
 
         if user['debt'] >= 1_000_000:
-            user['debt_limit_reached'] = True
+            self.database.update_user(user_id, {'debt_limit_reached': True})
 
-        self.database.update_user(user_id, user)
         self.bot.reply_to(message, f"Вы взяли {amount} KyZmaCoin в долг. Ваш текущий долг: {user['debt']} KyZmaCoin.")
         self.log(f"User @{message.from_user.username} took a dept {user['debt']} coins")
 
@@ -171,13 +271,17 @@ class Bank:
         if amount > user['debt']:
             amount = user['debt']
 
-        user['coins'] -= amount
-        user['debt'] -= amount
-
-        if user['debt'] < 1_000_000:
-            user['debt_limit_reached'] = False
+        user = self.database.apply_delta(
+            user_id,
+            {'coins': -amount, 'debt': -amount},
+            {'coins': {'$gte': amount}, 'debt': {'$gte': amount}},
+            set_fields={'debt_limit_reached': False},
+            reason='repay',
+        )
+        if user is None:
+            self.bot.reply_to(message, "У вас недостаточно средств для погашения этой суммы.")
+            return
 
-        self.database.update_user(user_id, user)
         self.bot.reply_to(message, f"Вы погасили {amount} KyZmaCoin. Ваш текущий долг: {user['debt']} KyZmaCoin.")
         self.log(f"User {message.from_user.username} repayed debt {amount} coins.")
 
@@ -188,19 +292,46 @@ class Bank:
         self.log(f"User {message.from_user.username} checked their debt")
 
     def remind_debtors(self):
-        """ Send a reminder to all users who have a debt """
-        users = self.database.find_users()
-        debtors = [user for user in users if user['debt'] > 0 and user['user_id'] != int(self.admin_id)]
-
-        for debtor in debtors:
-            message = f"Шановний/шановна {debtor['name']},\n\nПовідомляємо, що Ваш борг перед KyZma InVest становить {debtor['debt']} KyZmaCoin. Ми настійно просимо Вас погасити зазначену суму у найкоротші терміни. У разі неповернення боргу, ми будемо змушені вжити відповідних заходів.\n\nДля оплати боргу скористайтеся командою /repay.\n\nЗ повагою,\n\nАдміністрація KyZma InVest"
-            self.bot.send_message(debtor['user_id'], message)
-            self.log(f"Sent debt reminder to {debtor['nickname']}")
+        """ Send a reminder to all users who have a debt through the broadcast engine.
+        The broadcast logs one summary to the admin when it finishes """
+        return self.broadcaster.start('debt_reminder')
+
+    def debt_reminder_filter(self):
+        """ Debtors, other than the admin, not yet reminded in the current window """
+        return {
+            'debt': {'$gt': 0},
+            'user_id': {'$ne': self.admin_id},
+            '$or': [{'last_reminded_at': None}, {'last_reminded_at': {'$lte': time.time() - self.reminder_window}}],
+        }
+
+    def claim_debt_reminder(self, debtor):
+        """ Stamp last_reminded_at unless another run reminded the debtor in this window. Returns boolean """
+        now = time.time()
+        claimed = self.database.apply_delta(
+            debtor['user_id'],
+            {},
+            {'$or': [{'last_reminded_at': None}, {'last_reminded_at': {'$lte': now - self.reminder_window}}]},
+            set_fields={'last_reminded_at': now},
+        )
+        if claimed is None:
+            return False
+        debtor['last_reminded_at'] = now
+        return True
+
+    def release_debt_reminder(self, debtor):
+        """ Clear the stamp of a reminder that could not be delivered, so the next run retries the debtor.
+        A stamp changed since the claim belongs to another run and stays """
+        self.database.apply_delta(
+            debtor['user_id'], {}, {'last_reminded_at': debtor['last_reminded_at']}, set_fields={'last_reminded_at': None},
+        )
+
+    def render_debt_reminder(self, job, debtor):
+        """ Debt reminder text for one debtor """
+        return f"Шановний/шановна {debtor['name']},\n\nПовідомляємо, що Ваш борг перед KyZma InVest становить {debtor['debt']} KyZmaCoin. Ми настійно просимо Вас погасити зазначену суму у найкоротші терміни. У разі неповернення боргу, ми будемо змушені вжити відповідних заходів.\n\nДля оплати боргу скористайтеся командою /repay.\n\nЗ повагою,\n\nАдміністрація KyZma InVest"
 
     def transfer_coins(self, message):
         """ Transfer coins between users """
         sender_id = message.from_user.id
-        sender = self.database.find_user_id(sender_id)
 
         parts = message.text.split()
         if len(parts) != 3:
@@ -214,21 +345,21 @@ class Bank:
             self.bot.reply_to(message, "Сумма перевода должна быть больше нуля.")
             return
 
-        if sender['coins'] < amount:
-            self.bot.reply_to(message, "У вас недостаточно средств для перевода.")
-            return
-
         recipient = self.database.find_user_nickname(recipient_nickname)
         if recipient is None:
             self.bot.reply_to(message, "Пользователь не найден.")
             return
 
         # Deduct coins from the sender and add to the recipient
-        sender['coins'] -= amount
-        recipient['coins'] += amount
+        sender = self.database.apply_delta(sender_id, {'coins': -amount}, {'coins': {'$gte': amount}}, reason='transfer')
+        if sender is None:
+            self.bot.reply_to(message, "У вас недостаточно средств для перевода.")
+            return
 
-        self.database.update_user(sender_id, sender)
-        self.database.update_user(recipient['user_id'], recipient)
+        if self.database.apply_delta(recipient['user_id'], {'coins': amount}, reason='transfer') is None:
+            self.database.apply_delta(sender_id, {'coins': amount}, reason='transfer_refund')
+            self.bot.reply_to(message, "Пользователь не найден.")
+            return
 
         # Send confirmation messages to both users
         self.bot.reply_to(message, f"Вы успешно перевели {amount} KyZmaCoin пользователю {recipient['nickname']}.")
@@ -6,6 +6,9 @@ user_bot_commands = {
     'slot': "Играть в слоты",
     'balance': "Показать баланс",
     'goys': 'Гои KyZmaCoin',
+    'rank': 'Моё место в рейтинге',
+    'history': 'История операций',
+    'trend': 'График баланса',
     'roulette': 'Играть в рулетку',
     'borrow': 'Взять в долг',
     'repay': 'Выплатить долг',
@@ -25,4 +28,11 @@ admin_bot_commands = {
     'send_all': "Разослать всем",
     'send': "Разослать",
     'mafia': "Отправить в мафию",
+    'pool': "Статистика пула MongoDB",
+    'cache': "Статистика кэша пользователей",
+    'tgstats': "Статистика вызовов Telegram API",
+    'shards': "Очереди и задержки обработки апдейтов",
+    'set_level': "Изменить уровень доступа пользователя",
+    'jobs': "Запланированные задачи и их метрики",
+    'audit': "Сверить баланс пользователя с журналом",
 }
\ No newline at end of file
@@ -0,0 +1,245 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from os import getenv
+import os
+import socket
+import threading
+import time
+
+from apscheduler.triggers.interval import IntervalTrigger
+from pymongo import ReturnDocument
+from requests.exceptions import ConnectionError, Timeout
+from telebot.apihelper import ApiHTTPException, ApiTelegramException
+
+
+class RateLimiter:
+    """ Token bucket shared by all broadcast workers, with a global pause for Telegram's retry_after """
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until one message may be sent """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Stop every worker for the given number of seconds """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class BroadcastKind:
+    """ Describes who receives a kind of broadcast and what they are sent. filter may be a callable
+    returning the filter when the broadcast starts; claim(user) may veto a recipient just before sending
+    and on_failed(user) undoes the claim when the message finally could not be delivered """
+    def __init__(self, render, filter=None, projection=None, on_sent=None, claim=None, on_failed=None):
+        self.render = render
+        self.filter = filter or {}
+        self.projection = projection or {}
+        self.on_sent = on_sent
+        self.claim = claim
+        self.on_failed = on_failed
+
+
+class Broadcaster:
+    """ Sends messages to many users from a worker pool at a bounded global and per-chat rate.
+    Progress is checkpointed in the broadcasts collection so an interrupted broadcast resumes.
+    A running broadcast is leased to one bot replica, which renews the lease at every checkpoint;
+    once it expires another replica takes the broadcast over """
+    def __init__(self, bot, database, log_sink):
+        self.bot = bot
+        self.database = database
+        self.log_sink = log_sink
+        self.collection = database.db['broadcasts']
+        self.workers = int(getenv("BROADCAST_WORKERS", 8))
+        self.chunk_size = int(getenv("BROADCAST_CHUNK_SIZE", 200))
+        self.max_retries = int(getenv("BROADCAST_MAX_RETRIES", 3))
+        self.chat_interval = float(getenv("BROADCAST_CHAT_INTERVAL", 1))
+        self.report_interval = float(getenv("BROADCAST_REPORT_INTERVAL", 30))
+        self.lease = float(getenv("BROADCAST_LEASE", 300))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.rate_limiter = RateLimiter(float(getenv("BROADCAST_RATE", 25)))
+        self.kinds = {}
+        self._chat_next_send = {}
+        self._chat_lock = threading.Lock()
+
+    def setup_scheduler(self, scheduler):
+        """ Schedule resuming the broadcasts of a replica that stopped renewing their leases """
+        scheduler.add("broadcast_resume", self.resume_pending, IntervalTrigger(seconds=self.lease), lease=self.lease / 2)
+
+    def register(self, kind, render, filter=None, projection=None, on_sent=None, claim=None, on_failed=None):
+        """ Register a kind of broadcast. render(job, user) returns the text for one user """
+        self.kinds[kind] = BroadcastKind(render, filter, projection, on_sent, claim, on_failed)
+
+    def query(self, kind, last_user_id=None):
+        """ The users query of a broadcast of kind resuming after last_user_id. Returns dictionary """
+        kind = self.kinds[kind]
+        query = {**(kind.filter() if callable(kind.filter) else kind.filter), 'blocked': {'$ne': True}}
+        if last_user_id is not None:
+            query['user_id'] = {**query.get('user_id', {}), '$gt': last_user_id}
+        return query
+
+    def hot_queries(self):
+        """ The query of every registered kind, as a resumed broadcast runs it, in the format of
+        IndexManager.HOT_QUERIES. Returns dictionary """
+        return {f"broadcast_{kind}": ('users', self.query(kind, 0), [('user_id', 1)]) for kind in self.kinds}
+
+    def start(self, kind, text=None):
+        """ Start a broadcast in the background. Returns job id """
+        job = {
+            'kind': kind,
+            'text': text,
+            'status': 'running',
+            'last_user_id': None,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'skipped': 0,
+            'started_at': datetime.now(timezone.utc),
+            'owner': self.owner,
+            'lease_until': self._lease_until(),
+        }
+        job['_id'] = self.collection.insert_one(job).inserted_id
+        self._spawn(job)
+        return str(job['_id'])
+
+    def resume_pending(self):
+        """ Resume broadcasts that were interrupted by a crash or restart. Each one is claimed
+        atomically, so only the replica whose claim succeeds resumes it """
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            self.log_sink.log(f"Resuming broadcast {job['_id']} ({job['kind']}) after user {job['last_user_id']}")
+            self._spawn(job)
+
+    def _claim(self):
+        """ Take the lease of one running broadcast whose lease has expired. Returns job dictionary or None """
+        return self.collection.find_one_and_update(
+            {
+                'status': 'running',
+                'kind': {'$in': list(self.kinds)},
+                # Broadcasts started before leases existed have no lease_until
+                '$or': [{'lease_until': {'$lte': datetime.now(timezone.utc)}}, {'lease_until': None}],
+            },
+            {'$set': {'owner': self.owner, 'lease_until': self._lease_until()}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _lease_until(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease)
+
+    def _spawn(self, job):
+        threading.Thread(target=self._run, args=(job,), name=f"broadcast-{job['_id']}", daemon=True).start()
+
+    def _run(self, job):
+        """ Send the broadcast chunk by chunk in user_id order, checkpointing after each chunk """
+        kind = self.kinds[job['kind']]
+        projection = {'_id': 0, 'user_id': 1, **kind.projection}
+        users = self.database.iter_users(self.query(job['kind'], job['last_user_id']), projection, sort=[('user_id', 1)])
+
+        started = time.monotonic()
+        last_report = started
+        delivered = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="broadcast") as pool:
+            while True:
+                chunk = list(islice(users, self.chunk_size))
+                if not chunk:
+                    break
+                outcomes = list(pool.map(lambda user: self._deliver(job, kind, user), chunk))
+                counts = {outcome: outcomes.count(outcome) for outcome in ('sent', 'failed', 'blocked', 'skipped')}
+                job['last_user_id'] = chunk[-1]['user_id']
+                for outcome, count in counts.items():
+                    job[outcome] = job.get(outcome, 0) + count
+                delivered += len(chunk)
+                checkpoint = self.collection.update_one(
+                    {'_id': job['_id'], 'owner': self.owner},
+                    {'$set': {'last_user_id': job['last_user_id'], 'lease_until': self._lease_until()}, '$inc': counts},
+                )
+                if not checkpoint.matched_count:
+                    self.log_sink.log(f"Broadcast {job['_id']} was taken over by another replica, stopping")
+                    return
+                if time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    self.log_sink.log(self._progress(job, delivered, last_report - started))
+
+        self.collection.update_one(
+            {'_id': job['_id'], 'owner': self.owner},
+            {'$set': {'status': 'done', 'finished_at': datetime.now(timezone.utc)}, '$unset': {'lease_until': ''}},
+        )
+        self.log_sink.log("Finished " + self._progress(job, delivered, time.monotonic() - started))
+
+    def _deliver(self, job, kind, user):
+        """ Send one message, honouring retry_after and retrying transient errors. Returns outcome """
+        user_id = user['user_id']
+        if kind.claim and not kind.claim(user):
+            return 'skipped'
+        text = kind.render(job, user)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_chat(user_id)
+            self.rate_limiter.acquire()
+            try:
+                self.bot.send_message(user_id, text)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    self.rate_limiter.pause(retry_after)
+                    continue
+                if e.error_code == 403 or (e.error_code == 400 and 'chat not found' in e.description):
+                    self.database.update_user(user_id, {'blocked': True})
+                    return 'blocked'
+                if e.error_code >= 500:
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                print(f"Failed to send broadcast to {user_id}: {e}")
+                return self._failed(kind, user)
+            except (ApiHTTPException, ConnectionError, Timeout) as e:
+                print(f"Retrying broadcast to {user_id}: {e}")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            if kind.on_sent:
+                kind.on_sent(user)
+            return 'sent'
+        return self._failed(kind, user)
+
+    def _failed(self, kind, user):
+        if kind.on_failed:
+            kind.on_failed(user)
+        return 'failed'
+
+    def _wait_for_chat(self, chat_id):
+        """ Keep at least chat_interval seconds between two messages to the same chat """
+        with self._chat_lock:
+            now = time.monotonic()
+            send_at = max(now, self._chat_next_send.get(chat_id, 0.0))
+            self._chat_next_send[chat_id] = send_at + self.chat_interval
+            if len(self._chat_next_send) > 10000:
+                self._chat_next_send = {chat: at for chat, at in self._chat_next_send.items() if at > now}
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def _progress(self, job, delivered, seconds):
+        """ Progress line for the admin """
+        rate = delivered / seconds if seconds > 0 else 0.0
+        return (
+            f"broadcast {job['_id']} ({job['kind']}): sent {job['sent']}, failed {job['failed']}, "
+            f"blocked {job['blocked']}, skipped {job.get('skipped', 0)}, {rate:.1f} msg/s"
+        )
@@ -0,0 +1,88 @@
+from pymongo.errors import BulkWriteError, PyMongoError
+import time
+
+
+class BulkReport:
+    """ Outcome of one bulk mutation: per-batch timings, totals and partial failures """
+    def __init__(self, name):
+        self.name = name
+        self.batches = []
+        self.matched = 0
+        self.modified = 0
+        self.errors = []
+
+    def add_batch(self, size, seconds, matched, modified, errors=()):
+        """ Record one executed batch """
+        self.batches.append((size, seconds))
+        self.matched += matched
+        self.modified += modified
+        self.errors.extend(errors)
+
+    @property
+    def operations(self):
+        return sum(size for size, _ in self.batches)
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.batches)
+
+    def summary(self, max_lines=5):
+        """ Human readable report for the admin. Returns string """
+        lines = [
+            f"{self.name}: {len(self.batches)} batch(es), {self.operations} op(s), "
+            f"matched {self.matched}, modified {self.modified}, {self.seconds * 1000:.1f} ms"
+        ]
+        for index, (size, seconds) in enumerate(self.batches[:max_lines], start=1):
+            lines.append(f"  batch {index}: {size} op(s), {seconds * 1000:.1f} ms")
+        if len(self.batches) > max_lines:
+            lines.append(f"  ... {len(self.batches) - max_lines} more batch(es)")
+        if self.errors:
+            lines.append(f"Failures: {len(self.errors)}")
+            lines.extend(f"  {error}" for error in self.errors[:max_lines])
+        return "\n".join(lines)
+
+
+class BulkWriter:
+    """ Groups per-document changes into bulk_write batches of a configurable size """
+    def __init__(self, collection, batch_size=1000):
+        self.collection = collection
+        self.batch_size = batch_size
+
+    def update_many(self, name, filter, update):
+        """ Apply the same update to every matching document in one round trip. Returns BulkReport """
+        report = BulkReport(name)
+        started = time.perf_counter()
+        try:
+            result = self.collection.update_many(filter, update)
+            report.add_batch(1, time.perf_counter() - started, result.matched_count, result.modified_count)
+        except PyMongoError as e:
+            report.add_batch(1, time.perf_counter() - started, 0, 0, [str(e)])
+        return report
+
+    def write(self, name, requests, batch_size=None):
+        """ Execute an iterable of write requests (UpdateOne, ...) in unordered batches. Returns BulkReport """
+        report = BulkReport(name)
+        batch_size = batch_size or self.batch_size
+        batch = []
+        for request in requests:
+            batch.append(request)
+            if len(batch) >= batch_size:
+                self._write_batch(report, batch)
+                batch = []
+        if batch:
+            self._write_batch(report, batch)
+        return report
+
+    def _write_batch(self, report, batch):
+        """ Send one batch, recording partial failures instead of aborting the whole run """
+        started = time.perf_counter()
+        try:
+            result = self.collection.bulk_write(batch, ordered=False)
+            report.add_batch(len(batch), time.perf_counter() - started, result.matched_count, result.modified_count)
+        except BulkWriteError as e:
+            details = e.details
+            errors = [f"op {error['index']}: {error['errmsg']}" for error in details.get('writeErrors', [])]
+            report.add_batch(len(batch), time.perf_counter() - started,
+                             details.get('nMatched', 0), details.get('nModified', 0), errors)
+        except PyMongoError as e:
+            report.add_batch(len(batch), time.perf_counter() - started, 0, 0, [f"batch of {len(batch)}: {e}"])
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache:
+    """ Bounded in-process cache with LRU eviction and per-entry time to live """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """ Get cached value by key. Returns value or None on a miss """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """ Store value under key, evicting the least recently used entry when full.
+        A value older than the cached one's version (e.g. a read that raced a write) is not stored """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and (version is None or version < entry[2]):
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """ Remove key from the cache. Returns the cached value or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry else None
+
+    def clear(self):
+        """ Drop every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Snapshot of the cache counters. Returns dictionary """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,43 @@
+import heapq
+import threading
+
+
+class CooldownRegistry:
+    """ In-memory next-eligible time per user for one cooldown, so rejected attempts need no query.
+    Only users still cooling down are kept; a heap of deadlines evicts expired entries """
+    def __init__(self, period):
+        self.period = period
+        self._until = {}
+        self._deadlines = []
+        self._lock = threading.Lock()
+
+    def remaining(self, user_id, now):
+        """ Seconds until the user may act again, 0 if they may act now or are unknown """
+        with self._lock:
+            self._evict(now)
+            until = self._until.get(user_id)
+        return until - now if until is not None else 0
+
+    def start(self, user_id, started_at, now):
+        """ Record that the user acted at started_at """
+        until = started_at + self.period
+        if until <= now:
+            return
+        with self._lock:
+            self._until[user_id] = until
+            heapq.heappush(self._deadlines, (until, user_id))
+
+    def warm(self, entries, now):
+        """ Load (user_id, started_at) pairs, e.g. from the database at startup """
+        for user_id, started_at in entries:
+            self.start(user_id, started_at, now)
+
+    def __len__(self):
+        return len(self._until)
+
+    def _evict(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            until, user_id = heapq.heappop(self._deadlines)
+            # A later start pushed a newer deadline; only drop the entry if this one is current
+            if self._until.get(user_id) == until:
+                del self._until[user_id]
@@ -1,37 +1,185 @@
-from pymongo import MongoClient
+from pymongo import DESCENDING, MongoClient, ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError
 from os import getenv
+from cache import TTLCache
+from bulk import BulkWriter
+from ranking import RankingIndex
+from treasury import Treasury
+from ledger import Ledger
+from balance_history import HISTORY_FIELDS, BalanceHistory
+import contextvars
+import threading
+import time
 
-class MongoDB:
-    """ Class for working with MongoDB """
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """ Collects connection pool usage so the pool can be sized for peak traffic.
+    Checkout start times are kept per thread and per asyncio task, so it also serves the async client """
     def __init__(self):
-        self.client = MongoClient(getenv('MONGODB'))
-        self.db = self.client['kyzma']
+        self._lock = threading.Lock()
+        self._checkout_started = contextvars.ContextVar('checkout_started', default=None)
+        self.open_connections = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.set(time.monotonic())
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = self._checkout_started.get()
+        wait = time.monotonic() - started if started else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def stats(self):
+        """ Snapshot of the pool counters. Returns dictionary """
+        with self._lock:
+            return {
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'peak_checked_out': self.peak_checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_wait_ms': (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+            }
+
+
+class MongoDB:
+    """ Class for working with MongoDB. One instance is shared by every component of the bot.
+    MONGODB_MAX_POOL_SIZE bounds the connections of the whole process; with async_pool the
+    async runtime's client takes MONGODB_ASYNC_POOL_SIZE of them (half by default).
+    db_name overrides the database, e.g. a scratch one for benchmarks """
+    def __init__(self, async_pool=False, db_name=None):
+        self.pool_monitor = PoolMonitor()
+        self.async_pool_monitor = PoolMonitor()
+        total_pool_size = int(getenv('MONGODB_MAX_POOL_SIZE', 50))
+        self.async_pool_size = int(getenv('MONGODB_ASYNC_POOL_SIZE', total_pool_size // 2)) if async_pool else 0
+        self.max_pool_size = max(total_pool_size - self.async_pool_size, 1)
+        self.client = MongoClient(
+            getenv('MONGODB'),
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=int(getenv('MONGODB_MIN_POOL_SIZE', 0)),
+            maxIdleTimeMS=int(getenv('MONGODB_MAX_IDLE_TIME_MS', 300000)),
+            waitQueueTimeoutMS=int(getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+            connectTimeoutMS=int(getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+            serverSelectionTimeoutMS=int(getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            event_listeners=[self.pool_monitor],
+        )
+        self.db = self.client[db_name or 'kyzma']
         self.users_collection = self.db['users']
         self.parties_collection = self.db['parties']
         self.admin = getenv('ADMIN_ID')
+        cache_size = int(getenv('USER_CACHE_MAX_ENTRIES', 10000))
+        cache_ttl = float(getenv('USER_CACHE_TTL', 30))
+        self.user_cache = TTLCache(cache_size, cache_ttl)
+        self.nickname_cache = TTLCache(cache_size, cache_ttl)
+        # The budget account's coins are the treasury's, see Treasury.total
+        self.ranking = RankingIndex(exclude={Treasury.ACCOUNT})
+        self.bulk = BulkWriter(self.users_collection, batch_size=int(getenv('BULK_BATCH_SIZE', 1000)))
+        self.ledger = Ledger(self)
+        self.treasury = Treasury(self)
+        self.balance_history = BalanceHistory(self)
         
-    def find_users(self):
-        """ Find all users in database. Returns list of dictionaries """
-        return [self._convert_id(user) for user in self.users_collection.find({})]
+    def iter_users(self, filter=None, projection=None, batch_size=500, sort=None):
+        """ Stream users matching filter from the cursor, pulling only the projected fields.
+        Yields user dictionaries, so memory stays flat however many users there are """
+        cursor = self.users_collection.find(filter or {}, projection, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            for user in cursor:
+                yield self._convert_id(user)
+        finally:
+            cursor.close()
+
+    def top_users(self, field, filter=None, limit=10):
+        """ Top users by field, sorted and limited on the server through the field's index.
+        Returns list of dictionaries with nickname and field """
+        cursor = self.users_collection.find(filter or {}, {'_id': 0, 'nickname': 1, field: 1})
+        return list(cursor.sort(field, DESCENDING).limit(limit))
+
+    def count_users(self, filter=None):
+        """ Count users matching filter. Returns integer """
+        return self.users_collection.count_documents(filter or {})
     
     def find_user_id(self, user_id):
         """ Find user by user_id. Returns user dictionary or None """
-        user = self.users_collection.find_one({"user_id": user_id})
-        return self._convert_id(user) if user else None
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = self.users_collection.find_one({"user_id": user_id})
+            if not user:
+                return None
+            user = self._cache_user(self._convert_id(user))
+        return dict(user)
     
     def find_user_nickname(self, nickname):
         """ Find user by nickname. Returns user dictionary or None """
+        user_id = self.nickname_cache.get(nickname)
+        if user_id is not None:
+            user = self.user_cache.get(user_id)
+            if user is not None and user['nickname'] == nickname:
+                return dict(user)
         user = self.users_collection.find_one({"nickname": nickname})
-        return self._convert_id(user) if user else None
+        if not user:
+            return None
+        return dict(self._cache_user(self._convert_id(user)))
     
     def add_user(self, username, user_id, name):
-        """ Add user to the database. Takes username and user_id """
-        if self.find_user_id(user_id):
+        """ Add user to the database. Takes username and user_id. Users without a Telegram
+        username get nickname None; an existing user's nickname follows their username """
+        nickname = f"@{username}" if username else None
+        user = self.find_user_id(user_id)
+        if user:
+            if user['nickname'] != nickname:
+                try:
+                    self.update_user(user_id, {'nickname': nickname})
+                except DuplicateKeyError:
+                    return f"Nickname {nickname} is already taken"
             return f"User {username} already exists"
         
         new_user = {
             'user_id': user_id,
-            'nickname': f"@{username}",
+            'nickname': nickname,
             'coins': 0,
             'last_farm_time': 0,
             'access_level': 'user',
@@ -39,25 +187,119 @@ class MongoDB:
             'debt_limit_reached': False,
             'name': name,
             'deposit': 0,
+            'last_accrual_at': None,
             'grechka': 0,
             'party': None,
         }
         try:
             self.users_collection.insert_one(new_user)
+            self.ledger.join(user_id)
+            self._cache_user(self._convert_id(new_user))
+            self.ranking.update(new_user)
             return f"User {username} added successfully"
+        except DuplicateKeyError:
+            self._log_error(f"Error adding user {username}: nickname {nickname} is already taken")
+            return f"Nickname {nickname} is already taken"
         except Exception as e:
             self._log_error(f"Error adding user {username}: {e}")
             return f"Error adding user {username}: {e}"
         
+    def clear_placeholder_nicknames(self):
+        """ Older versions stored "@None" for users without a username; store None instead,
+        so the unique nickname index only covers real nicknames """
+        result = self.users_collection.update_many({'nickname': '@None'}, {'$set': {'nickname': None}})
+        if result.modified_count:
+            self.user_cache.clear()
+            self.nickname_cache.clear()
+        return result.modified_count
+
     def update_user(self, user_id, updated_data):
         """ Update user data. Takes user_id and dictionary with fields to update """
         updated_data.pop('_id', None)
-        self.users_collection.update_one({"user_id": user_id}, {"$set": updated_data})
+        user = self.users_collection.find_one_and_update(
+            {"user_id": user_id}, {"$set": updated_data, "$inc": {"version": 1}}, return_document=ReturnDocument.AFTER,
+        )
+        self._invalidate_user(user_id)
+        if user:
+            self.balance_history.record(user_id, updated_data)
+            self._rank(user)
+            self._cache_user(self._convert_id(user))
         return f"User {user_id} updated successfully"
     
+    def apply_delta(self, user_id, deltas, conditions=None, set_fields=None, reason=None, entry_id=None):
+        """ Atomically apply $inc deltas to a user in one round trip.
+        Takes user_id, dictionary of field deltas, optional extra filter conditions
+        (e.g. {"coins": {"$gte": 100}} to subtract 100 coins only if the user has them)
+        and optional fields to $set. A reason records the balance change in the ledger,
+        see Ledger.record. Returns updated user dictionary or None if the user
+        does not exist or a condition did not hold """
+        query = {"user_id": user_id}
+        if conditions:
+            query.update(conditions)
+        # The version orders this write against others to the user, see RankingIndex
+        update = {"$inc": {**deltas, "version": 1}}
+        if set_fields:
+            update["$set"] = set_fields
+        user = self.users_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if not user:
+            return None
+        return self._after_delta(user_id, user, deltas, reason, entry_id)
+
+    def _after_delta(self, user_id, user, deltas, reason=None, entry_id=None):
+        """ Bookkeeping after apply_delta wrote user, shared by AsyncMongoDB: ledger, balance history,
+        ranking and cache. Returns the updated user dictionary """
+        if reason:
+            self.ledger.record(user_id, deltas, reason, entry_id)
+        if any(field in deltas for field in HISTORY_FIELDS):
+            self.balance_history.record(user_id, user)
+        self._rank(user)
+        return dict(self._cache_user(self._convert_id(user)))
+
+    def _rank(self, user):
+        """ Apply a written user document to the ranking. A document the ranking finds no newer than
+        its own either lost a race to a later write or predates a write to every user, so the
+        ranking takes the user's current document instead """
+        if not self.ranking.update(user):
+            projection = {'_id': 0, 'user_id': 1, 'nickname': 1, 'version': 1, **{field: 1 for field in self.ranking.fields}}
+            current = self.users_collection.find_one({'user_id': user['user_id']}, projection)
+            if current:
+                self.ranking.update(current)
+
+    def inc_all_users(self, name, deltas, filter=None):
+        """ Apply the same $inc to every matching user in one update_many. Returns BulkReport.
+        Without a filter the change is recorded in the ledger once, for every user, under name """
+        ranked = [field for field in deltas if field in self.ranking.fields]
+        with self.ranking.writing_all():
+            report = self.bulk.update_many(name, filter or {}, {"$inc": {**deltas, "version": 1}})
+            if ranked and not filter and not report.errors:
+                self.ranking.shift_all(deltas)
+        if not filter and not report.errors:
+            self.ledger.record(None, deltas, name)
+        self.user_cache.clear()
+        if ranked and (filter or report.errors):
+            self.rebuild_ranking()
+        return report
+
+    def bulk_update_users(self, name, requests, fields=None):
+        """ Apply per-user write requests (UpdateOne, ...) in bulk_write batches.
+        fields names the user fields the requests touch; None means unknown. Returns BulkReport """
+        report = self.bulk.write(name, requests)
+        self.user_cache.clear()
+        if fields is None or any(field in self.ranking.fields for field in fields):
+            self.rebuild_ranking()
+        return report
+
+    def rebuild_ranking(self):
+        """ Rebuild the in-memory ranking from the database in one streaming pass """
+        projection = {'_id': 0, 'user_id': 1, 'nickname': 1, 'version': 1, **{field: 1 for field in self.ranking.fields}}
+        self.ranking.rebuild(self.iter_users(projection=projection))
+
     def add_new_field(self, field_name, default_value):
         """ Add new field to all users in the database. Takes field name and default value """
         self.users_collection.update_many({}, {"$set": {field_name: default_value}})
+        self.user_cache.clear()
+        if field_name in self.ranking.fields:
+            self.rebuild_ranking()
         return f"Field {field_name} added successfully"
 
     def get_access_level(self, user_id):
@@ -131,6 +373,43 @@ class MongoDB:
         self.update_user(user_id, party=None)
         return f"Гражданин {user['nickname']} был изгнан с партии {party_name}."
     
+    def pool_stats(self):
+        """ Connection pool usage report, one section per client. Returns string """
+        pools = [("Sync pool", self.pool_monitor, self.max_pool_size)]
+        if self.async_pool_size:
+            pools.append(("Async pool", self.async_pool_monitor, self.async_pool_size))
+        reports = []
+        for name, monitor, max_pool_size in pools:
+            stats = monitor.stats()
+            reports.append(
+                f"{name} size: {stats['open_connections']}/{max_pool_size}\n"
+                f"Checked out: {stats['checked_out']} (peak {stats['peak_checked_out']})\n"
+                f"Checkouts: {stats['checkouts']}, failed: {stats['checkout_failures']}\n"
+                f"Wait: avg {stats['avg_wait_ms']:.2f} ms, max {stats['max_wait_ms']:.2f} ms"
+            )
+        return "\n\n".join(reports)
+
+    def cache_stats(self):
+        """ User cache usage report. Returns string """
+        stats = self.user_cache.stats()
+        return (
+            f"Entries: {stats['entries']}/{stats['max_entries']}, TTL {stats['ttl']:g} s\n"
+            f"Hits: {stats['hits']}, misses: {stats['misses']} ({stats['hit_rate']:.0%} hit rate)\n"
+            f"Evictions: {stats['evictions']}, expirations: {stats['expirations']}"
+        )
+
+    def _cache_user(self, user):
+        """ Put user document into the read-through cache. Returns the cached document """
+        self.user_cache.put(user['user_id'], user, user.get('version'))
+        self.nickname_cache.put(user['nickname'], user['user_id'])
+        return user
+
+    def _invalidate_user(self, user_id):
+        """ Drop cached user document after a write """
+        user = self.user_cache.pop(user_id)
+        if user is not None:
+            self.nickname_cache.pop(user['nickname'])
+
     def _convert_id(self, document):
         """ Convert ObjectId to string for JSON serialization """
         if document and '_id' in document:
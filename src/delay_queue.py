@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import time
+
+
+class DelayQueue:
+    """ Runs callbacks after a delay. One timer thread waits for the earliest deadline and hands
+    due callbacks to a small pool, so handlers schedule a delayed reply instead of sleeping """
+    def __init__(self, workers=4, name="delay-queue"):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, function, *args):
+        """ Run function(*args) on the pool after delay seconds """
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), function, args))
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, function, args = heapq.heappop(self._heap)
+            self._pool.submit(self._call, function, args)
+
+    def _call(self, function, args):
+        try:
+            function(*args)
+        except Exception as e:
+            print(f"Delayed call {getattr(function, '__name__', function)} failed: {e}")
@@ -1,59 +1,93 @@
 import time
 import random
 
-import telebot
 from os import getenv
 
 from bot.bot_replies import bot_replies
-
-from database import MongoDB
+from cooldowns import CooldownRegistry
 
 class Farm:
-    def __init__(self):
+    def __init__(self, bot, database, log_sink):
         self.bot_replies = bot_replies
-        self.bot = telebot.TeleBot(getenv("BOT_TOKEN"))
-        self.database = MongoDB()
-        self.budget = 5587251063
+        self.bot = bot
+        self.database = database
+        self.log_sink = log_sink
         self.owner = getenv("ADMIN_ID")
         self.farm_rare_coins = 600
         self.farm_rare_chance = 0.1
         self.tax = 0.4
+        self.cooldown = 3600
+        self.cooldowns = CooldownRegistry(self.cooldown)
+
+    def warm_cooldowns(self):
+        """ Load the users who farmed within the last hour into the cooldown registry """
+        now = time.time()
+        users = self.database.iter_users(
+            {'last_farm_time': {'$gt': now - self.cooldown}}, {'_id': 0, 'user_id': 1, 'last_farm_time': 1}
+        )
+        self.cooldowns.warm(((user['user_id'], user['last_farm_time']) for user in users), now)
     
     def farm_coin(self, message, user, current_time):
         """ Farm coins for the user"""
-        coins = 0
-        coins_tax = 0
-        coins_after_tax = 0
-        
         if user is None:
             self.bot.reply_to(message, self.bot_replies['error_database'])
+            return
+
+        remaining_time = self.remaining(user, current_time)
+        if remaining_time > 0:
+            self.bot.reply_to(message, self.cooldown_message(remaining_time))
+            return
+
+        coins, coins_tax, coins_after_tax = self.harvest()
+        print(coins_after_tax)
+        # The cooldown condition keeps two concurrent /farm commands from both paying out
+        user = self.database.apply_delta(user['user_id'], *self.delta(coins_after_tax, current_time), reason='farm')
+        if user is None:
+            self.bot.reply_to(message, "Вы уже фармили в этом часе.")
+            return
+        self.cooldowns.start(user['user_id'], current_time, current_time)
+        self.database.treasury.add(coins_tax, 'farm_tax')
+        print(f"User {user['nickname']} farmed {coins} coins. Total: {user['coins']}")
+        self.bot.reply_to(message, self.result_message(coins, coins_tax, coins_after_tax, user['coins']))
+        self.log_sink.log(f"{coins_tax} added to budget.")
+        return user
+
+    def remaining(self, user, current_time):
+        """ Seconds until the user may farm again according to their document """
+        remaining_time = self.cooldown - (current_time - user['last_farm_time'])
+        if remaining_time > 0:
+            # Another replica saw this farm, or it predates the registry; remember it from now on
+            self.cooldowns.start(user['user_id'], user['last_farm_time'], current_time)
+        return remaining_time
+
+    def cooldown_message(self, remaining_time):
+        """ Message for a user who may farm again in remaining_time seconds """
+        remaining_minutes = remaining_time // 60
+        remaining_seconds = remaining_time % 60
+        return f"Вы можете фармить снова через {int(remaining_minutes)} минут и {int(remaining_seconds)} секунд."
+
+    def harvest(self):
+        """ Roll the harvest. Returns (coins, coins_tax, coins_after_tax) """
+        if random.random() < self.farm_rare_chance:
+            coins = self.farm_rare_coins
         else:
-            if current_time - user['last_farm_time'] < 3600:
-                remaining_time = 3600 - (current_time - user['last_farm_time'])
-                remaining_minutes = remaining_time // 60
-                remaining_seconds = remaining_time % 60
-                self.bot.reply_to(message, f"Вы можете фармить снова через {int(remaining_minutes)} минут и {int(remaining_seconds)} секунд.")
-            else:
-                if random.random() < self.farm_rare_chance:
-                    coins = self.farm_rare_coins
-                    coins_tax = round(coins * self.tax)
-                    coins_after_tax = coins - coins_tax
-                else:
-                    coins = random.randint(40, 480)
-                    coins_tax = round(coins * self.tax)
-                    coins_after_tax = coins - coins_tax
-                print(coins_after_tax)
-                budget = self.database.find_user_id(self.budget)
-                budget['coins'] += coins_tax
-                self.database.update_user(self.budget, budget)
-                user['coins'] += coins_after_tax
-                user['last_farm_time'] = current_time
-                print(f"User {user['nickname']} farmed {coins} coins. Total: {user['coins']}")
-                self.bot.reply_to(message,
-                    f"Вы заработали {coins} KyZmaCoin\n"
-                    f"Налог: {coins_tax} KyZmaCoin\n"
-                    f"Зарплата после налога: {coins_after_tax} KyZmaCoin\n" 
-                    f"Итоговая сумма: {user['coins']} KyZmaCoin\n"
-                    f"Вы сможете снова фармить через 1 час")
-                self.bot.send_message(self.owner, f"{coins_tax} added to budget.\n Budget:{budget['coins']}")
-                return user
+            coins = random.randint(40, 480)
+        coins_tax = round(coins * self.tax)
+        return coins, coins_tax, coins - coins_tax
+
+    def delta(self, coins_after_tax, current_time):
+        """ apply_delta arguments that pay out and restart the cooldown only if it has expired """
+        return (
+            {'coins': coins_after_tax},
+            {'last_farm_time': {'$lte': current_time - self.cooldown}},
+            {'last_farm_time': current_time},
+        )
+
+    def result_message(self, coins, coins_tax, coins_after_tax, total):
+        return (
+            f"Вы заработали {coins} KyZmaCoin\n"
+            f"Налог: {coins_tax} KyZmaCoin\n"
+            f"Зарплата после налога: {coins_after_tax} KyZmaCoin\n"
+            f"Итоговая сумма: {total} KyZmaCoin\n"
+            f"Вы сможете снова фармить через 1 час"
+        )
@@ -1,16 +1,51 @@
 from bot.bot_replies import bot_replies
-import random
-import telebot
 from os import getenv
+import random
+
+WHEEL = range(37)  # 0 (green) and numbers 1–36
+RED = frozenset({1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36})
+BLACK = frozenset(WHEEL) - RED - {0}
+
+
+def _payouts(numbers, multiplier):
+    """ Net coins per coin staked for every result of the wheel """
+    return tuple(multiplier if result in numbers else -1 for result in WHEEL)
+
+
+# Bet name -> (winning numbers, net multiplier); a slip is resolved through the PAYOUTS rows below
+BETS = {
+    'красный': (RED, 1),
+    'черный': (BLACK, 1),
+    'чет': (frozenset(range(2, 37, 2)), 1),
+    'нечет': (frozenset(range(1, 37, 2)), 1),
+    '1-18': (frozenset(range(1, 19)), 1),
+    '19-36': (frozenset(range(19, 37)), 1),
+    '1-12': (frozenset(range(1, 13)), 2),
+    '13-24': (frozenset(range(13, 25)), 2),
+    '25-36': (frozenset(range(25, 37)), 2),
+    'к1': (frozenset(range(1, 37, 3)), 2),
+    'к2': (frozenset(range(2, 37, 3)), 2),
+    'к3': (frozenset(range(3, 37, 3)), 2),
+    **{str(number): (frozenset({number}), 35) for number in WHEEL},  # Standard payout for a number bet
+}
+BETS['чёрный'] = BETS['черный']
+PAYOUTS = {name: _payouts(numbers, multiplier) for name, (numbers, multiplier) in BETS.items()}
+
 
 class Roulette:
-    def __init__(self):
+    def __init__(self, bot, database):
         self.bot_replies = bot_replies
-        self.bot = telebot.TeleBot(getenv("BOT_TOKEN"))
-        self.NUMBER_PAYOUT_MULTIPLIER = 35  # Standard roulette payout for a number bet
+        self.bot = bot
+        self.database = database
+        self.max_bets = int(getenv("ROULETTE_MAX_BETS", 10))
+        self.usage = (
+            "Неверный формат. Используйте: <i>/roulette ставка цель [ставка цель ...]</i>\n"
+            "Цели: красный, черный, чет, нечет, 1-18, 19-36, 1-12, 13-24, 25-36, к1, к2, к3 "
+            "или номера от 0 до 36 через запятую."
+        )
 
     def roulette_game(self, message, user):
-        """Simple Roulette Game with Red/Black and numbers"""
+        """ Roulette with a slip of several bets resolved against one spin and committed in one write """
 
         # Validate user
         if user is None or not isinstance(user, dict) or 'coins' not in user:
@@ -22,70 +57,69 @@ class Roulette:
             self.bot.send_animation(message.chat.id, 'https://i.giphy.com/media/v1.Y2lkPTc5MGI3NjExZXo5YWtjM3JxOXFhdnZ6eXgyN2s3NnR1ZzEzNXhiczQ2MWw0ODQ1ZyZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/ytdPUwmGshqsJqZhET/giphy-downsized-large.gif')
             return
 
-        # Parse the bet
-        parts = message.text.split()
-        if len(parts) != 3:
-            self.bot.reply_to(message, "Неверный формат. Используйте: <i>/roulette ставка красный/черный/номер</i>", parse_mode="HTML")
+        bets, error = self.parse_bets(message.text.split()[1:])
+        if error:
+            self.bot.reply_to(message, error, parse_mode="HTML")
             return
 
-        try:
-            bet_amount = int(parts[1])
-        except ValueError:
-            self.bot.reply_to(message, "Сумма ставки должна быть числом.")
+        stake = sum(amount for _, amount in bets)
+        if stake > user['coins']:
+            self.bot.reply_to(message, "У вас недостаточно монет для этой ставки.")
             return
 
-        bet_type = parts[2].lower()
+        result = self.spin()
+        nets = self.resolve(bets, result)
 
-        # Validate bet amount
-        if bet_amount <= 0:
-            self.bot.reply_to(message, "Сумма ставки должна быть больше нуля.")
-            return
-
-        if bet_amount > user['coins']:
+        # Commit the outcome only if the user still has the whole stake
+        user = self.database.apply_delta(user['user_id'], {'coins': sum(nets)}, {'coins': {'$gte': stake}}, reason='roulette')
+        if user is None:
             self.bot.reply_to(message, "У вас недостаточно монет для этой ставки.")
             return
 
-        # Validate bet type
-        if bet_type not in ["красный", "черный"] and not bet_type.isdigit():
-            self.bot.reply_to(message, "Неверный тип ставки. Используйте 'красный', 'черный', или номер от 0 до 36.")
-            return
-
-        if bet_type.isdigit():
-            bet_number = int(bet_type)
-            if bet_number < 0 or bet_number > 36:
-                self.bot.reply_to(message, "Номер ставки должен быть от 0 до 36.")
-                return
-
-        # Spin the roulette wheel
-        roulette_wheel = [0] + list(range(1, 37))  # 0 (green) and numbers 1–36
-        red_numbers = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
-        black_numbers = [2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35]
-
-        result = random.choice(roulette_wheel)
-
-        # Determine the result message
+        self.bot.reply_to(message, self.result_message(result, bets, nets, user['coins']))
+        return user
+
+    def parse_bets(self, parts):
+        """ Parse "amount target" pairs; a target may list several numbers separated by commas,
+        each staked with the amount. Returns (list of (target, amount), error message or None) """
+        if not parts or len(parts) % 2:
+            return [], self.usage
+
+        bets = []
+        for amount, targets in zip(parts[::2], parts[1::2]):
+            if not amount.isdigit():
+                return [], "Сумма ставки должна быть числом."
+            if int(amount) <= 0:
+                return [], "Сумма ставки должна быть больше нуля."
+            for target in targets.lower().split(','):
+                if target not in PAYOUTS:
+                    return [], self.usage
+                bets.append((target, int(amount)))
+
+        if len(bets) > self.max_bets:
+            return [], f"Не больше {self.max_bets} ставок за один спин."
+        return bets, None
+
+    def spin(self):
+        return random.choice(WHEEL)
+
+    def resolve(self, bets, result):
+        """ Net coins won (negative when lost) by each bet for one result. Returns list of integers """
+        return [amount * PAYOUTS[target][result] for target, amount in bets]
+
+    def result_message(self, result, bets, nets, coins):
+        """ Text shown to the player after the slip is committed """
         if result == 0:
-            result_message = "Выпал 0 (Зеленый)."
-        elif result in red_numbers:
-            result_message = f"Выпал номер {result} (Красный)."
+            lines = ["Выпал 0 (Зеленый)."]
         else:
-            result_message = f"Выпал номер {result} (Черный)."
-
-        # Determine if the bet is a win or a loss
-        if bet_type == "красный" and result in red_numbers:
-            user['coins'] += bet_amount
-            win_message = f"Поздравляем! Вы выиграли {bet_amount} KyZmaCoin. Теперь у вас {user['coins']} KyZmaCoin."
-        elif bet_type == "черный" and result in black_numbers:
-            user['coins'] += bet_amount
-            win_message = f"Поздравляем! Вы выиграли {bet_amount} KyZmaCoin. Теперь у вас {user['coins']} KyZmaCoin."
-        elif bet_type.isdigit() and int(bet_type) == result:
-            user['coins'] += bet_amount * self.NUMBER_PAYOUT_MULTIPLIER
-            win_message = f"Поздравляем! Вы угадали число {result}. Вы выиграли {bet_amount * self.NUMBER_PAYOUT_MULTIPLIER} KyZmaCoin. Теперь у вас {user['coins']} KyZmaCoin."
+            lines = [f"Выпал номер {result} ({'Красный' if result in RED else 'Черный'})."]
+        for (target, amount), net in zip(bets, nets):
+            lines.append(f"{target} {amount}: {'выигрыш +' + str(net) if net > 0 else 'проигрыш'}")
+        total = sum(nets)
+        if total > 0:
+            lines.append(f"Поздравляем! Вы выиграли {total} KyZmaCoin. Теперь у вас {coins} KyZmaCoin.")
+        elif total < 0:
+            lines.append(f"Увы, вы проиграли {-total} KyZmaCoin. Теперь у вас {coins} KyZmaCoin.")
         else:
-            user['coins'] -= bet_amount
-            win_message = f"Увы, вы проиграли {bet_amount} KyZmaCoin. Теперь у вас {user['coins']} KyZmaCoin."
-
-        # Send the result to the user
-        self.bot.reply_to(message, f"{result_message}\n{win_message}")
-
-        return user
\ No newline at end of file
+            lines.append(f"Вы остались при своих. Теперь у вас {coins} KyZmaCoin.")
+        return "\n".join(lines)
@@ -1,16 +1,18 @@
 import random
-import time
+from os import getenv
 from bot.bot_replies import bot_replies
 
-import telebot
-from os import getenv
 
 class Slots:
-    def __init__(self):
+    def __init__(self, bot, database, delay_queue):
         self.bot_replies = bot_replies
-        self.bot = telebot.TeleBot(getenv("BOT_TOKEN"))
+        self.bot = bot
+        self.database = database
+        self.delay_queue = delay_queue
         self.slot_jackpot_chance = 0.05
         self.slot_win_chance = 0.2
+        # The result is revealed once the dice animation has played
+        self.reveal_delay = float(getenv("SLOT_REVEAL_DELAY", 1))
         
     def slot_machine(self, message, user):
         """ Simple Slot Machine Game with fruits as the results"""
@@ -24,8 +26,18 @@ class Slots:
             return
 
         self.bot.send_dice(message.chat.id, emoji="🎰")
-        time.sleep(1)
 
+        results, amount = self.spin()
+        user = self.database.apply_delta(user['user_id'], *self.delta(amount), reason='slots')
+        if user is None:
+            self.bot.reply_to(message, self.bot_replies['error_database' if amount > 0 else 'error_no_coins'])
+            return
+
+        self.delay_queue.call_later(self.reveal_delay, self.bot.reply_to, message, self.result_message(results, amount, user['coins']))
+        return user
+
+    def spin(self):
+        """ Spin the reels. Returns (results, coins won or negative coins lost) """
         fruits = ["🍒", "🍋", "🍊", "🍉", "🍇", "🍓", "🍍", "🍑"]
 
         results = [random.choice(fruits) for _ in range(3)]
@@ -34,20 +46,19 @@ class Slots:
             selected_fruit = random.choice(fruits)
             results = [selected_fruit] * 3
 
-        message_result = f"Вы прокрутили слоты и получили: {results[0]} - {results[1]} - {results[2]}\n"
-
         if results[0] == results[1] == results[2]:
-            win_amount = 0
             if random.random() < self.slot_jackpot_chance:
-                win_amount = 250
-            else:
-                win_amount = random.randint(15, 40)
-            user['coins'] += win_amount
-            message_result += f"Поздравляем! Вы выиграли {win_amount} KyZmaCoin! У вас теперь {user['coins']} KyZmaCoin."
-        else:
-            lose_amount = random.randint(10, 25)
-            user['coins'] -= lose_amount
-            message_result += f"Увы, вы проиграли {lose_amount} KyZmaCoin. У вас теперь {user['coins']} KyZmaCoin."
-
-        self.bot.reply_to(message, message_result)
-        return user
\ No newline at end of file
+                return results, 250
+            return results, random.randint(15, 40)
+        return results, -random.randint(10, 25)
+
+    def delta(self, amount):
+        """ apply_delta arguments for a spin; a loss only applies while the player still has coins """
+        return {'coins': amount}, (None if amount > 0 else {'coins': {'$gt': 0}})
+
+    def result_message(self, results, amount, coins):
+        """ Text shown to the player after the spin is committed """
+        message_result = f"Вы прокрутили слоты и получили: {results[0]} - {results[1]} - {results[2]}\n"
+        if amount > 0:
+            return message_result + f"Поздравляем! Вы выиграли {amount} KyZmaCoin! У вас теперь {coins} KyZmaCoin."
+        return message_result + f"Увы, вы проиграли {-amount} KyZmaCoin. У вас теперь {coins} KyZmaCoin."
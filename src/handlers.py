@@ -1,30 +1,36 @@
-from database import MongoDB
 from bot.bot_commands import user_bot_commands, admin_bot_commands
 from bot.bot_replies import bot_replies
 from games.roulette import Roulette
 from games.slots import Slots
 from games.farm import Farm
 from bank import Bank
+from cache import TTLCache
+from log_sink import LogSink
+from broadcast import Broadcaster
+from delay_queue import DelayQueue
+from balance_history import HISTORY_FIELDS, sparkline
 
 from os import getenv
 import telebot
 from telebot import types
 import time
-import schedule
-import threading
 
 class Handlers:
     """ Class for handling bot commands"""
-    def __init__(self):
-        self.bot = telebot.TeleBot(getenv("BOT_TOKEN"))
-        self.database = MongoDB()
-        self.roulette = Roulette()
-        self.slots = Slots()
-        self.farm = Farm()
-        self.bank = Bank()
+    def __init__(self, bot, database, scheduler):
+        self.bot = bot
+        self.database = database
         self.admin_id = getenv("ADMIN_ID")
-        self.budget = 5587251063
+        self.log_sink = LogSink(self.bot, self.admin_id)
+        self.broadcaster = Broadcaster(self.bot, database, self.log_sink)
+        self.broadcaster.setup_scheduler(scheduler)
+        self.roulette = Roulette(bot, database)
+        self.delay_queue = DelayQueue(workers=int(getenv("DELAY_QUEUE_WORKERS", 4)))
+        self.slots = Slots(bot, database, self.delay_queue)
+        self.farm = Farm(bot, database, self.log_sink)
+        self.bank = Bank(bot, database, self.log_sink, self.broadcaster, scheduler)
         self.amnesty_requests = {}
+        self.leaderboard_cache = TTLCache(max_entries=2, ttl=float(getenv("LEADERBOARD_CACHE_TTL", 10)))
                 
         self.user_bot_commands = user_bot_commands
         self.admin_bot_commands = admin_bot_commands
@@ -32,11 +38,8 @@ class Handlers:
         self.set_commands()
         
     def log(self, message):
-        """ Log messages to the admin in bot chat """
-        try:
-            self.bot.send_message(self.admin_id, message)
-        except Exception as e:
-            print(f"Failed to log message: {e}")
+        """ Log messages to the admin in bot chat. Delivered in digests by the log sink """
+        self.log_sink.log(message)
         
     def set_commands(self):
         """ Set bot commands"""
@@ -54,7 +57,12 @@ class Handlers:
         """ Start the bot"""
         username = message.from_user.username
         user_id = message.from_user.id
-        self.database.add_user(username, user_id, name=None)
+        result = self.database.add_user(username, user_id, name=None)
+        if self.database.find_user_id(user_id) is None:
+            self.bot.reply_to(message, f"Не удалось зарегистрироваться: {result}. Попробуйте ещё раз позже или обратитесь к администрации.")
+            return
+        # Writing to the bot again means the user unblocked it
+        self.database.update_user(user_id, {'blocked': False})
             
         self.bot.reply_to(message, self.bot_replies['welcome'], reply_markup=self.create_keyboard())
         self.log(f"User {username} started the bot")
@@ -76,36 +84,56 @@ class Handlers:
                 
     def send_top_users(self, message):
         """ Send top 10 users by coins, excluding the admin """
-        users = self.database.find_users()
+        self.bot.reply_to(message, self.top_users_message())
+        self.log(f"User {message.from_user.username} used /top")
         
-        users = [user for user in users if user['user_id']]
+    def top_users_message(self):
+        """ Top users text, served from the leaderboard cache """
+        top_users_message = self.leaderboard_cache.get('slonyari')
+        if top_users_message is None:
+            top_users_message = self.render_top_users()
+            self.leaderboard_cache.put('slonyari', top_users_message)
+        return top_users_message
         
-        sorted_users = sorted(users, key=lambda x: x['coins'], reverse=True)
+    def render_top_users(self):
+        """ Render the top 10 users by coins from the in-memory ranking, or an indexed query until it is built """
+        if self.database.ranking.ready:
+            sorted_users = self.database.ranking.top('coins', 10)
+        else:
+            sorted_users = self.database.top_users('coins', {'user_id': {'$nin': [None, 0, self.database.treasury.ACCOUNT]}})
         
         top_users_message = "Топ слоняр в KyZma InVest:\n"
         
-        for i, user in enumerate(sorted_users[:10], start=1):
-            top_users_message += f"{i}. {user['nickname'][1:]} - {user['coins']} KyZmaCoin\n"
+        for i, user in enumerate(sorted_users, start=1):
+            top_users_message += f"{i}. {(user['nickname'] or '@None')[1:]} - {user['coins']} KyZmaCoin\n"
         
         if not sorted_users:
             top_users_message = self.bot_replies['error_no_users']
-        
-        self.bot.reply_to(message, top_users_message)
-        self.log(f"User {message.from_user.username} used /top")
+        return top_users_message
         
     def send_debtors(self, message):
         """ Send a list of users with debt in descending order """
-        users = self.database.find_users()
+        self.bot.send_message(message.chat.id, self.debtors_message())
+        self.log(f"User {message.from_user.username} used /goys")
         
-        # Filter users with debt > 0 and exclude the admin
-        debtors = [user for user in users if user['debt'] > 0 and user['user_id'] != int(self.admin_id)]
+    def debtors_message(self):
+        """ Debtors text, served from the leaderboard cache """
+        debtors_message = self.leaderboard_cache.get('goys')
+        if debtors_message is None:
+            debtors_message = self.render_debtors()
+            self.leaderboard_cache.put('goys', debtors_message)
+        return debtors_message
         
-        # Sort debtors by debt in descending order
-        sorted_debtors = sorted(debtors, key=lambda x: x['debt'], reverse=True)
+    def render_debtors(self):
+        """ Render the 10 largest debts, excluding the admin, from the in-memory ranking or an indexed query """
+        if self.database.ranking.ready:
+            sorted_debtors = self.database.ranking.top('debt', 10, exclude={int(self.admin_id)}, positive=True)
+        else:
+            sorted_debtors = self.database.top_users('debt', {'debt': {'$gt': 0}, 'user_id': {'$nin': [int(self.admin_id), self.database.treasury.ACCOUNT]}})
         
         debtors_message = "Список должников в KyZma InVest:\n"
         
-        for i, debtor in enumerate(sorted_debtors[:10], start=1):
+        for i, debtor in enumerate(sorted_debtors, start=1):
             nickname = debtor['nickname']
             if nickname:
                 nickname = nickname[1:]  # Убираем первый символ
@@ -116,15 +144,66 @@ class Handlers:
         
         if not sorted_debtors:
             debtors_message = "Никто не имеет задолженностей."
-        
-        self.bot.send_message(message.chat.id, debtors_message)
-        self.log(f"User {message.from_user.username} used /goys")
+        return debtors_message
     
-    def setup_schedules(self):
-        """ Setup the daily reminder to send debt reminders """
-        schedule.every().day.at("22:00").do(self.bank.remind_debtors)
-        schedule.every(1).hour.do(self.bank.apply_interest_to_all_users)
+    def send_rank(self, message):
+        """ Send the user's own place by coins and by debt, answered from the in-memory ranking """
+        self.bot.reply_to(message, self.rank_message(message.from_user.id))
+        
+    def rank_message(self, user_id):
+        """ Render the user's place by coins and by debt """
+        coins_rank = self.database.ranking.rank('coins', user_id)
+        if coins_rank is None:
+            return self.bot_replies['error_database']
+        
+        place, coins, total = coins_rank
+        rank_message = f"Ваше место среди слоняр: {place} из {total} ({coins} KyZmaCoin)"
+        
+        debt_rank = self.database.ranking.rank('debt', user_id)
+        if debt_rank and debt_rank[1] > 0:
+            place, debt, _ = debt_rank
+            rank_message += f"\nВаше место среди должников: {place} ({debt} KyZmaCoin)"
+        return rank_message
 
+    def send_history(self, message):
+        """ Send the user's latest balance changes from the ledger """
+        self.bot.reply_to(message, self.history_message(message.from_user.id))
+
+    def history_message(self, user_id):
+        """ Render the user's latest ledger entries, newest first """
+        entries = self.database.ledger.history(user_id, limit=int(getenv("HISTORY_LIMIT", 10)))
+        if not entries:
+            return "История операций пуста."
+        lines = ["Последние операции (UTC):"]
+        for entry in entries:
+            changes = ", ".join(f"{field} {amount:+}" for field, amount in entry['delta'].items())
+            lines.append(f"{entry['ts']:%d.%m %H:%M} {entry['reason']}: {changes or '-'}")
+        return "\n".join(lines)
+
+    def send_trend(self, message):
+        """ Send a sparkline of the user's balance: /trend [coins|deposit|debt] [days] """
+        field, days = 'coins', 7
+        for part in message.text.split()[1:]:
+            if part in HISTORY_FIELDS:
+                field = part
+            elif part.isdigit() and 1 <= int(part) <= 31:
+                days = int(part)
+            else:
+                self.bot.reply_to(message, f"Неверный формат. Используйте: <i>/trend [{'/'.join(HISTORY_FIELDS)}] [дней 1-31]</i>", parse_mode="HTML")
+                return
+        self.bot.reply_to(message, self.trend_message(message.from_user.id, field, days))
+
+    def trend_message(self, user_id, field, days):
+        """ Render the field over the last days, one point per day (per hour over the last 24 hours for a single day) """
+        values = self.database.balance_history.series(user_id, field, days)
+        if not values:
+            return "История баланса пока пуста."
+        period = "24 часа" if days == 1 else f"{days} дн."
+        return (
+            f"{field} за {period}:\n{sparkline(values)}\n"
+            f"Мин {min(values)}, макс {max(values)}, сейчас {values[-1]}"
+        )
+    
     def vzaimorozchety(self, message):
         """ Взаиморозщеты🦗 """
         self.bot.reply_to(message, "Взаиморозщеты🦗")
@@ -138,26 +217,27 @@ class Handlers:
             return
         
         self.bot.reply_to(message, "Что касается вашей амнистии? Опишите, пожалуйста, ситуацию.")
-        self.amnesty_requests[user_id] = {'step': 1}
+        self.amnesty_requests[user_id] = {}
+        self.router.set_state(user_id, 'amnesty_reason')
 
     def collect_amnesty_reason(self, message):
         """ Collect the reason for amnesty """
         user_id = message.from_user.id
         reason = message.text
-        if user_id not in self.amnesty_requests or self.amnesty_requests[user_id]['step'] != 1:
+        if user_id not in self.amnesty_requests:
             return
         
         # Store the reason and ask for the message
         self.amnesty_requests[user_id]['reason'] = reason
         self.bot.reply_to(message, "Теперь напишите сообщение для администратора, которое вы хотите отправить.")
-        self.amnesty_requests[user_id]['step'] = 2
+        self.router.set_state(user_id, 'amnesty_message')
 
     def collect_amnesty_message(self, message):
         """ Collect the message for amnesty """
         user_id = message.from_user.id
         amnesty_data = self.amnesty_requests.get(user_id)
         
-        if not amnesty_data or amnesty_data['step'] != 2:
+        if not amnesty_data or 'reason' not in amnesty_data:
             return
         
         # Store the message
@@ -172,136 +252,86 @@ class Handlers:
         # Inform the user and reset the process
         self.bot.reply_to(message, "Ваш запрос на амнистию отправлен админу. Ожидайте ответа.")
         self.amnesty_requests.pop(user_id)
+        self.router.clear_state(user_id)
         
     def brekotkin(self, message):
         self.bot.send_sticker(message.chat.id, 'CAACAgIAAxUAAWeWoeYf-5vui6OHXEb8vnX1obM_AAJMaAAC-iC4SEoPeyXlvEOhNgQ')
 
-    def setup_handlers(self):
-        """ Setup bot handlers"""
-        @self.bot.message_handler(commands=['start'])
-        def start(message):
-            self.start(message)
-            # self.database.add_new_field('party', None)
-            
-        @self.bot.message_handler(commands=['help'])
-        def help(message):
-            self.send_help(message)
-        
-        @self.bot.message_handler(commands=['farm'])
-        def farm(message):
-            user_id = message.from_user.id
-            user = self.database.find_user_id(user_id)
-            current_time = time.time()
-            
-            game_result = self.farm.farm_coin(message, user, current_time)
-            if game_result is not None:
-                self.database.update_user(user_id, game_result)
-                self.log(f"User {message.from_user.username} farmed coins.\n\nTotal: {user['coins']}")
-            else:
-                print("Game result is None, skipping database update.")
-            
-        @self.bot.message_handler(commands=['slonyari'])
-        def top(message):
-            self.send_top_users(message)
-            
-        @self.bot.message_handler(commands=['slot'])
-        def slot(message):
-            # self.slot_machine(message)
-            user_id = message.from_user.id
-            user = self.database.find_user_id(user_id)
-            game_result = self.slots.slot_machine(message, user)
-            if game_result is not None:
-                self.database.update_user(user_id, game_result)
-                self.log(f"User {message.from_user.username} played slots.")
-            else:
-                print("Game result is None, skipping database update.")
-            
-        @self.bot.message_handler(commands=['roulette'])
-        def roulette(message):
-            user_id = message.from_user.id
-            user = self.database.find_user_id(user_id)
-            game_result = self.roulette.roulette_game(message, user)
-            if game_result is not None:
-                self.database.update_user(user_id, game_result)
-                self.log(f"User {message.from_user.username} played roulette.")
-            else:
-                print("Game result is None, skipping database update.")
-            
-        @self.bot.message_handler(commands=['balance'])
-        def balance(message):
-            self.bank.check_balance(message, message.from_user.id)
-            
-        @self.bot.message_handler(commands=['goys'])
-        def send_goys(message):
-            self.send_debtors(message)
-            
-        @self.bot.message_handler(func=lambda message: message.text == self.bot_replies['pashalko'])
-        def handle_text(message):
-            self.vzaimorozchety(message)
-                        
-        @self.bot.message_handler(commands=['borrow'])
-        def borrow_handler(message):
-            self.bank.borrow_money(message)
-
-        @self.bot.message_handler(commands=['repay'])
-        def repay_handler(message):
-            self.bank.repay_debt(message)
-
-        @self.bot.message_handler(commands=['debt'])
-        def debt_handler(message):
-            self.bank.check_debt(message)
-            
-        @self.bot.message_handler(commands=['deposit'])
-        def deposit_handler(message):
-            self.bank.deposit_money(message)
-        
-        @self.bot.message_handler(commands=['withdraw'])
-        def withdraw_handler(message):
-            self.bank.withdraw_money(message)
-            
-        @self.bot.message_handler(commands=['amnisty'])
-        def amnisty(message):
-            """ Handle the /amnisty command """
-            self.request_amnesty(message)
-        
-        @self.bot.message_handler(func=lambda message: message.from_user.id in self.amnesty_requests and self.amnesty_requests[message.from_user.id]['step'] == 1)
-        def handle_amnesty_reason(message):
-            """ Handle the reason part of the amnesty """
-            self.collect_amnesty_reason(message)
+    def farm_coin(self, message):
+        user_id = message.from_user.id
+        current_time = time.time()
+        # Most /farm attempts are spam during the cooldown; answer those from memory
+        remaining_time = self.farm.cooldowns.remaining(user_id, current_time)
+        if remaining_time > 0:
+            self.bot.reply_to(message, self.farm.cooldown_message(remaining_time))
+            return
+        user = self.database.find_user_id(user_id)
         
-        @self.bot.message_handler(func=lambda message: message.from_user.id in self.amnesty_requests and self.amnesty_requests[message.from_user.id]['step'] == 2)
-        def handle_amnesty_message(message):
-            """ Handle the message part of the amnesty """
-            self.collect_amnesty_message(message)
+        game_result = self.farm.farm_coin(message, user, current_time)
+        if game_result is not None:
+            self.log(f"User {message.from_user.username} farmed coins.\n\nTotal: {game_result['coins']}")
+        else:
+            print("Game result is None, skipping database update.")
             
-        @self.bot.message_handler(commands=['transfer'])
-        def transfer(message):
-            self.bank.transfer_coins(message)
+    def slot_machine(self, message):
+        user_id = message.from_user.id
+        user = self.database.find_user_id(user_id)
+        game_result = self.slots.slot_machine(message, user)
+        if game_result is not None:
+            self.log(f"User {message.from_user.username} played slots.")
+        else:
+            print("Game result is None, skipping database update.")
             
-        @self.bot.message_handler(commands=['apply'])
-        def apply_interest(message):
-            self.bank.apply_interest_to_all_users()
+    def roulette_game(self, message):
+        user_id = message.from_user.id
+        user = self.database.find_user_id(user_id)
+        game_result = self.roulette.roulette_game(message, user)
+        if game_result is not None:
+            self.log(f"User {message.from_user.username} played roulette.")
+        else:
+            print("Game result is None, skipping database update.")
             
-        @self.bot.message_handler(commands=['brekotkin'])
-        def send_brekotkin(message):
-            self.brekotkin(message)
-                    
-        @self.bot.message_handler(func=lambda message: True)  # Catch all other messages
-        def forward_to_admin(message):
-            username = message.from_user.username or "Unknown"
-            print("Message received: ", message.text)
-            parts = message.text.split()
-            user = self.database.find_user_id(message.from_user.id)
-            budget = self.database.find_user_id(self.budget)
-            if parts[0] == "кузьма" or parts[0] == "Кузьма":
-                if user:
-                    self.database.update_user(message.from_user.id, {"coins": user["coins"] - 1})
-                    self.database.update_user(self.budget, {"coins": budget["coins"] + 1})
-                    self.bot.send_message(self.admin_id, f"@{username}: {message.text}")
-                    self.bot.reply_to(message, "Сообщение отправлено администратору.")
-                elif not user:
-                    self.bot.reply_to(message, "Вы не зарегистрированы в KyZma InVest. Используйте /start для регистрации.")
-                else:
-                    self.bot.reply_to(message, "Вам не хватает коинсов для обращения к администрации KyZma InVest.")
+    def forward_to_admin(self, message):
+        """ Forward a "кузьма ..." message to the admin for one coin """
+        username = message.from_user.username or "Unknown"
+        user = self.database.find_user_id(message.from_user.id)
+        if not user:
+            self.bot.reply_to(message, "Вы не зарегистрированы в KyZma InVest. Используйте /start для регистрации.")
+        elif self.database.apply_delta(message.from_user.id, {"coins": -1}, {"coins": {"$gte": 1}}, reason="kuzma"):
+            self.database.treasury.add(1, "kuzma")
+            self.bot.send_message(self.admin_id, f"@{username}: {message.text}")
+            self.bot.reply_to(message, "Сообщение отправлено администратору.")
+        else:
+            self.bot.reply_to(message, "Вам не хватает коинсов для обращения к администрации KyZma InVest.")
 
-        threading.Thread(target=self.setup_schedules, daemon=True).start()
\ No newline at end of file
+    def setup_handlers(self, router):
+        """ Setup bot handlers"""
+        self.router = router
+        commands = {
+            'start': self.start,
+            'help': self.send_help,
+            'farm': self.farm_coin,
+            'slonyari': self.send_top_users,
+            'slot': self.slot_machine,
+            'roulette': self.roulette_game,
+            'balance': lambda message: self.bank.check_balance(message, message.from_user.id),
+            'goys': self.send_debtors,
+            'rank': self.send_rank,
+            'history': self.send_history,
+            'trend': self.send_trend,
+            'borrow': self.bank.borrow_money,
+            'repay': self.bank.repay_debt,
+            'debt': self.bank.check_debt,
+            'deposit': self.bank.deposit_money,
+            'withdraw': self.bank.withdraw_money,
+            'amnisty': self.request_amnesty,
+            'transfer': self.bank.transfer_coins,
+            'apply': lambda message: self.bank.apply_interest_to_all_users(),
+            'brekotkin': self.brekotkin,
+        }
+        for command, handler in commands.items():
+            router.command(command, handler)
+        router.text(self.bot_replies['pashalko'], self.vzaimorozchety)
+        router.prefix("кузьма", self.forward_to_admin)
+        router.state('amnesty_reason', self.collect_amnesty_reason)
+        router.state('amnesty_message', self.collect_amnesty_message)
@@ -0,0 +1,125 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+
+class IndexManager:
+    """ Declares the indexes behind the bot's hot lookups and creates them on startup """
+    # (collection, field or list of (field, direction) for a compound key, direction, unique, partial filter)
+    INDEXES = [
+        ('users', 'user_id', ASCENDING, True, None),
+        # Users without a username have nickname None and stay out of the unique index
+        ('users', 'nickname', ASCENDING, True, {'nickname': {'$type': 'string'}}),
+        ('users', 'coins', DESCENDING, False, None),
+        ('users', 'debt', DESCENDING, False, {'debt': {'$gt': 0}}),
+        ('users', 'deposit', DESCENDING, False, {'deposit': {'$gt': 0}}),
+        ('users', 'last_farm_time', DESCENDING, False, None),
+        # Debt reminders walk debtors in user_id order and skip those reminded in the current window
+        ('users', [('user_id', ASCENDING), ('last_reminded_at', ASCENDING)], None, False, {'debt': {'$gt': 0}}),
+        # /history reads one user's entries by time; rebuilds and snapshots read by insert time
+        ('ledger', [('user_id', ASCENDING), ('ts', ASCENDING)], None, False, None),
+        ('ledger', [('user_id', ASCENDING), ('inserted_at', ASCENDING)], None, False, None),
+        ('ledger', 'inserted_at', ASCENDING, False, None),
+        ('balance_snapshots', [('generation', ASCENDING), ('user_id', ASCENDING)], None, False, None),
+        # /trend reads one user's day buckets by date
+        ('balance_history', [('user_id', ASCENDING), ('day', ASCENDING)], None, False, None),
+        ('parties', 'party_name', ASCENDING, True, None),
+        ('parties', 'party_creator', ASCENDING, True, None),
+    ]
+
+    # Queries issued on every message; none of them may scan the whole collection
+    HOT_QUERIES = {
+        'find_user_id': ('users', {'user_id': 0}, None),
+        'find_user_nickname': ('users', {'nickname': '@'}, None),
+        'find_party_name': ('parties', {'party_name': ''}, None),
+        'find_party_id': ('parties', {'party_creator': 0}, None),
+        'debtors': ('users', {'debt': {'$gt': 0}}, None),
+        'depositors': ('users', {'deposit': {'$gt': 0}}, None),
+        'recent_farmers': ('users', {'last_farm_time': {'$gt': 0}}, None),
+        'top_coins': ('users', {'user_id': {'$nin': [None, 0]}}, [('coins', DESCENDING)]),
+        'top_debt': ('users', {'debt': {'$gt': 0}, 'user_id': {'$nin': [0, 0]}}, [('debt', DESCENDING)]),
+        'ledger_history': ('ledger', {'user_id': {'$in': [0, None]}}, [('ts', DESCENDING)]),
+        'ledger_snapshot': ('balance_snapshots', {'generation': 0, 'user_id': 0}, None),
+        'balance_trend': ('balance_history', {'user_id': 0, 'day': {'$gte': ''}}, [('day', ASCENDING)]),
+    }
+
+    def __init__(self, database):
+        self.database = database
+
+    def ensure_indexes(self):
+        """ Create every declared index. Unique indexes are only enforced when the data has no duplicates """
+        for collection_name, field, direction, unique, partial in self.INDEXES:
+            collection = self.database.db[collection_name]
+            if unique:
+                duplicates = self.find_duplicates(collection_name, field, partial)
+                if duplicates:
+                    self._report_duplicates(collection_name, field, duplicates)
+                    unique = False
+            self._create_index(collection, field, direction, unique, partial)
+
+    def find_duplicates(self, collection_name, field, partial=None, limit=10):
+        """ Find values of field shared by several documents the index covers. Returns list of (value, count) """
+        pipeline = [
+            {'$match': partial or {}},
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+            {'$sort': {'count': -1}},
+            {'$limit': limit},
+        ]
+        collection = self.database.db[collection_name]
+        return [(group['_id'], group['count']) for group in collection.aggregate(pipeline, allowDiskUse=True)]
+
+    def check_hot_queries(self, extra=None):
+        """ Explain every hot query, plus the extra ones built at runtime (e.g. Broadcaster.hot_queries),
+        and raise RuntimeError if any of them falls back to a COLLSCAN """
+        collscans = []
+        for name, (collection_name, query, sort) in {**self.HOT_QUERIES, **(extra or {})}.items():
+            cursor = self.database.db[collection_name].find(query).limit(1)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()
+            if self._has_stage(plan.get('queryPlanner', {}).get('winningPlan', {}), 'COLLSCAN'):
+                collscans.append(f"{name} ({collection_name} {query})")
+        if collscans:
+            raise RuntimeError(f"Hot queries fall back to COLLSCAN: {', '.join(collscans)}")
+        return True
+
+    def _create_index(self, collection, field, direction, unique, partial):
+        """ Create one index, replacing an existing index on the same key if its options changed """
+        key = field if isinstance(field, list) else [(field, direction)]
+        fields = "_".join(key_field for key_field, _ in key)
+        if partial:
+            suffix = 'unique' if unique else 'positive'
+            options = {'name': f"{fields}_{suffix}", 'unique': unique, 'partialFilterExpression': partial}
+        else:
+            options = {'name': f"{fields}_{'unique' if unique else 'lookup'}", 'unique': unique}
+
+        for name, info in collection.index_information().items():
+            if info['key'] != key or name == '_id_':
+                continue
+            same = (name == options['name'] and info.get('unique', False) == unique
+                    and info.get('partialFilterExpression') == partial)
+            if same:
+                return
+            collection.drop_index(name)
+
+        try:
+            collection.create_index(key, **options)
+        except OperationFailure as e:
+            self.database._log_error(f"Error creating index {collection.name}.{options['name']}: {e}")
+
+    def _report_duplicates(self, collection_name, field, duplicates):
+        """ Report duplicated values that prevent a unique index """
+        values = ", ".join(f"{value!r} x{count}" for value, count in duplicates)
+        self.database._log_error(
+            f"Unique index on {collection_name}.{field} not enforced, duplicates found: {values}"
+        )
+
+    def _has_stage(self, plan, stage):
+        """ Walk an explain() plan tree looking for the given stage """
+        if isinstance(plan, dict):
+            if plan.get('stage') == stage:
+                return True
+            return any(self._has_stage(value, stage) for value in plan.values())
+        if isinstance(plan, list):
+            return any(self._has_stage(value, stage) for value in plan)
+        return False
@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta, timezone
+from os import getenv
+import threading
+
+from apscheduler.triggers.interval import IntervalTrigger
+from pymongo import DESCENDING, InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from bulk import BulkWriter
+
+BALANCE_FIELDS = ('coins', 'deposit', 'debt', 'grechka')
+DUPLICATE_KEY = 11000
+
+
+class Ledger:
+    """ Append-only history of balance changes, one entry {user_id, delta, reason, ts, inserted_at}
+    per change. user_id None marks a change applied to every user. Entries are buffered and inserted in
+    batches by a writer thread, so recording costs the caller no round trip. Periodic snapshots of every
+    balance let any balance be rebuilt from the latest snapshot plus the entries inserted after it """
+    def __init__(self, database):
+        self.database = database
+        self.entries = database.db['ledger']
+        self.snapshots = database.db['balance_snapshots']
+        self.state = database.db['ledger_state']
+        self.batch_size = int(getenv('LEDGER_BATCH_SIZE', 500))
+        self.flush_interval = float(getenv('LEDGER_FLUSH_INTERVAL', 1))
+        # Entries younger than the lag stay out of a snapshot: other replicas may not have flushed them yet
+        self.snapshot_lag = float(getenv('LEDGER_SNAPSHOT_LAG', 60))
+        # Entries kept while MongoDB is unreachable; past it the oldest are dropped
+        self.max_buffered = int(getenv('LEDGER_MAX_BUFFERED', 100000))
+        self.snapshot_writer = BulkWriter(self.snapshots, batch_size=int(getenv('BULK_BATCH_SIZE', 1000)))
+        self.written = 0
+        self.dropped = 0
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+
+    def setup_scheduler(self, scheduler):
+        """ Schedule the periodic snapshots """
+        hours = float(getenv('LEDGER_SNAPSHOT_HOURS', 24))
+        scheduler.add("ledger_snapshot", self.snapshot, IntervalTrigger(hours=hours), lease=3600)
+
+    def record(self, user_id, deltas, reason, entry_id=None):
+        """ Queue an entry with the balance fields of deltas; other fields are ignored.
+        entry_id makes a change that may be recorded twice (e.g. a raced settlement) count once """
+        delta = {field: deltas[field] for field in BALANCE_FIELDS if deltas.get(field)}
+        if delta:
+            self._append({'user_id': user_id, 'delta': delta, 'reason': reason}, entry_id)
+
+    def join(self, user_id):
+        """ Mark where a new user's history starts, so earlier changes to every user are not counted """
+        self._append({'user_id': user_id, 'delta': {}, 'reason': 'join'})
+
+    def flush(self):
+        """ Insert every buffered entry. Entries of a failed insert go back to the buffer """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._buffer = self._buffer, []
+            for start in range(0, len(batch), self.batch_size):
+                self._insert(batch[start:start + self.batch_size])
+
+    def history(self, user_id, limit=10):
+        """ Latest entries of the user, including changes applied to every user. Returns list of dictionaries """
+        cursor = self.entries.find({'user_id': {'$in': [user_id, None]}}, {'_id': 0})
+        return list(cursor.sort('ts', DESCENDING).limit(limit))
+
+    def balance(self, user_id):
+        """ Rebuild the user's balances from the latest snapshot and the entries after it.
+        Returns dictionary of BALANCE_FIELDS or None if the ledger does not cover the user """
+        state = self.state.find_one({'_id': 'snapshot'})
+        if state is None:
+            return None
+        snapshot = self.snapshots.find_one({'generation': state['generation'], 'user_id': user_id})
+        query = {'user_id': {'$in': [user_id, None]}, 'inserted_at': {'$gt': state['cutoff']}}
+        if snapshot is not None:
+            balances = {field: snapshot[field] for field in BALANCE_FIELDS}
+        else:
+            joined = self.entries.find_one({'user_id': user_id, 'reason': 'join', 'inserted_at': {'$gt': state['cutoff']}})
+            if joined is None:
+                return None
+            balances = dict.fromkeys(BALANCE_FIELDS, 0)
+            query['ts'] = {'$gte': joined['ts']}
+        for entry in self.entries.find(query, {'_id': 0, 'delta': 1}):
+            for field, amount in entry['delta'].items():
+                balances[field] += amount
+        return balances
+
+    def ensure_snapshot(self):
+        """ Take the first snapshot from the users collection unless one exists.
+        Called on startup, before the bot handles updates """
+        # Entries written before inserted_at existed fall back to their record time
+        self.entries.update_many({'inserted_at': {'$exists': False}}, [{'$set': {'inserted_at': '$ts'}}])
+        if self.state.find_one({'_id': 'snapshot'}) is None:
+            self.seed()
+
+    def seed(self):
+        """ Generation 0: the current balances of every user """
+        cutoff = datetime.now(timezone.utc)
+        self.snapshots.delete_many({})
+        projection = {'_id': 0, 'user_id': 1, **{field: 1 for field in BALANCE_FIELDS}}
+        users = self.database.iter_users({'user_id': {'$ne': None}}, projection)
+        report = self.snapshot_writer.write("ledger seed", (
+            InsertOne({'generation': 0, 'user_id': user['user_id'], **self._balances(user)}) for user in users
+        ))
+        # The budget account's coins live partly in the treasury stripes
+        treasury = self.database.treasury
+        self.snapshots.update_one(
+            {'generation': 0, 'user_id': treasury.ACCOUNT}, {'$set': {'coins': treasury.total()}}, upsert=True,
+        )
+        self.state.replace_one({'_id': 'snapshot'}, {'generation': 0, 'cutoff': cutoff}, upsert=True)
+        return report
+
+    def snapshot(self):
+        """ Write the next generation of snapshots: the previous generation plus the entries up to
+        the cutoff. Readers switch to it only once it is complete. Returns BulkReport """
+        self.flush()
+        state = self.state.find_one({'_id': 'snapshot'})
+        if state is None:
+            return self.seed()
+        previous, generation = state['generation'], state['generation'] + 1
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.snapshot_lag)
+        # Leftovers of an interrupted run
+        self.snapshots.delete_many({'generation': {'$gte': generation}})
+
+        # Windows go by insert time, so an entry recorded before a cutoff but inserted after it
+        # (e.g. retried through an outage) is counted by the next snapshot instead of never
+        window = {'$gt': state['cutoff'], '$lte': cutoff}
+        shared = list(self.entries.find({'user_id': None, 'inserted_at': window}, {'_id': 0, 'delta': 1, 'ts': 1}))
+        tails = {tail['_id']: tail for tail in self.entries.aggregate([
+            {'$match': {'user_id': {'$ne': None}, 'inserted_at': window}},
+            {'$group': {
+                '_id': '$user_id',
+                'joined': {'$min': {'$cond': [{'$eq': ['$reason', 'join']}, '$ts', None]}},
+                **{field: {'$sum': f'$delta.{field}'} for field in BALANCE_FIELDS},
+            }},
+        ], allowDiskUse=True)}
+
+        report = self.snapshot_writer.write("ledger snapshot", self._snapshot_requests(previous, generation, shared, tails))
+        if report.errors:
+            self.database._log_error(f"Ledger snapshot {generation} failed, keeping {previous}:\n{report.summary()}")
+            return report
+        self.state.update_one({'_id': 'snapshot'}, {'$set': {'generation': generation, 'cutoff': cutoff}})
+        self.snapshots.delete_many({'generation': {'$lt': generation}})
+        return report
+
+    def stats(self):
+        """ Ledger writer report. Returns string """
+        with self._condition:
+            buffered = len(self._buffer)
+        return f"Ledger: {self.written} written, {buffered} buffered, {self.dropped} dropped"
+
+    def _snapshot_requests(self, previous, generation, shared, tails):
+        """ One InsertOne per user of the new generation """
+        everyone = self._sum(entry['delta'] for entry in shared)
+        for snapshot in self.snapshots.find({'generation': previous}, {'_id': 0}):
+            tail = tails.pop(snapshot['user_id'], {})
+            balances = {field: snapshot[field] + everyone[field] + tail.get(field, 0) for field in BALANCE_FIELDS}
+            yield InsertOne({'generation': generation, 'user_id': snapshot['user_id'], **balances})
+        for user_id, tail in tails.items():
+            if tail['joined'] is None:
+                print(f"Ledger has entries for {user_id} but no snapshot or join entry, skipping")
+                continue
+            joined = self._sum(entry['delta'] for entry in shared if entry['ts'] >= tail['joined'])
+            balances = {field: tail[field] + joined[field] for field in BALANCE_FIELDS}
+            yield InsertOne({'generation': generation, 'user_id': user_id, **balances})
+
+    def _sum(self, deltas):
+        total = dict.fromkeys(BALANCE_FIELDS, 0)
+        for delta in deltas:
+            for field, amount in delta.items():
+                total[field] += amount
+        return total
+
+    def _balances(self, user):
+        return {field: user.get(field) or 0 for field in BALANCE_FIELDS}
+
+    def _append(self, entry, entry_id=None):
+        if entry_id is not None:
+            entry['_id'] = entry_id
+        with self._condition:
+            entry['ts'] = datetime.now(timezone.utc)
+            self._buffer.append(entry)
+            self._trim()
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def _trim(self):
+        """ Drop the oldest entries past max_buffered. Called with the condition held """
+        overflow = len(self._buffer) - self.max_buffered
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            print(f"Ledger buffer full, dropped the {overflow} oldest entries")
+
+    def _run(self):
+        while True:
+            try:
+                with self._condition:
+                    self._condition.wait_for(lambda: len(self._buffer) >= self.batch_size, self.flush_interval)
+                self.flush()
+            except Exception as e:
+                print(f"Ledger flush failed: {e}")
+
+    def _insert(self, batch):
+        """ Insert one batch. Entries recorded before under the same entry_id are skipped silently.
+        Every attempt stamps inserted_at anew; the snapshot lag keeps it clear of the cutoff being taken """
+        inserted_at = datetime.now(timezone.utc)
+        for entry in batch:
+            entry['inserted_at'] = inserted_at
+        try:
+            self.entries.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get('writeErrors', []) if error['code'] != DUPLICATE_KEY]
+            self.written += e.details.get('nInserted', 0)
+            if errors:
+                self.dropped += len(errors)
+                print(f"Ledger dropped {len(errors)} entries: {errors[0]['errmsg']}")
+        except PyMongoError as e:
+            print(f"Ledger write of {len(batch)} entries failed, retrying: {e}")
+            with self._condition:
+                self._buffer[:0] = batch
+                self._trim()
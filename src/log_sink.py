@@ -0,0 +1,84 @@
+from os import getenv
+import queue
+import threading
+import time
+
+
+class LogSink:
+    """ Background admin log pipeline. Handlers only enqueue events; a worker thread merges
+    them into digest messages and sends them within a per-chat rate limit """
+    MAX_MESSAGE_LENGTH = 4096
+
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.flush_interval = float(getenv("ADMIN_LOG_FLUSH_INTERVAL", 10))
+        self.max_events = int(getenv("ADMIN_LOG_MAX_EVENTS", 50))
+        self.min_send_interval = float(getenv("ADMIN_LOG_MIN_INTERVAL", 3))
+        self.queue = queue.Queue(maxsize=int(getenv("ADMIN_LOG_QUEUE_SIZE", 1000)))
+        self._lock = threading.Lock()
+        self._last_send = 0.0
+        self.dropped = 0
+        self.digests_sent = 0
+        self._worker = threading.Thread(target=self._run, name="admin-log-sink", daemon=True)
+        self._worker.start()
+
+    def log(self, message):
+        """ Queue an event for the next digest. Never blocks the caller """
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            events = self._collect()
+            try:
+                self._send_digest(events)
+            except Exception as e:
+                print(f"Failed to log message: {e}")
+
+    def _collect(self):
+        """ Wait for the first event, then gather more until max_events or flush_interval is reached """
+        events = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(events) < self.max_events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def _send_digest(self, events):
+        """ Merge repeated events, summarise overflow and send one message """
+        wait = self._last_send + self.min_send_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+
+        self.bot.send_message(self.chat_id, self._render(events, dropped))
+        self._last_send = time.monotonic()
+        self.digests_sent += 1
+
+    def _render(self, events, dropped):
+        """ Render events as one digest, collapsing identical lines and truncating to Telegram's limit """
+        counts = {}
+        for event in events:
+            event = str(event)[:1000]
+            counts[event] = counts.get(event, 0) + 1
+        lines = [event if count == 1 else f"{event} (x{count})" for event, count in counts.items()]
+
+        footer = f"\n... {dropped} event(s) dropped under backpressure" if dropped else ""
+        digest = ""
+        for index, line in enumerate(lines):
+            if len(digest) + len(line) + len(footer) + 40 > self.MAX_MESSAGE_LENGTH:
+                footer = f"\n... {len(lines) - index} more event(s)" + footer
+                break
+            digest += ("\n" if digest else "") + line
+        return digest + footer
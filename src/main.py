@@ -1,21 +1,65 @@
 from handlers import Handlers
-from admin_handler import AdminHandler, AccessLevel
+from admin_handler import AdminHandler
+from access_control import AccessControl
 from party import Party
+from database import MongoDB
+from indexes import IndexManager
+from telegram_client import TelegramClient
+from webhook import WebhookServer
+from router import Router
+from sharded_executor import ShardedExecutor
+from scheduler import JobScheduler
+from os import getenv
 
 class Bot:
     def __init__(self):
-        self.handlers = Handlers()
-        self.bot = self.handlers.bot
-        self.admin_handlers = AdminHandler(self.bot)
-        self.party = Party(self.bot)
+        self.mode = getenv("BOT_MODE", "polling")
+        # Polling may run on the asyncio runtime with BOT_RUNTIME=async; webhook mode is always sync
+        self.runtime = getenv("BOT_RUNTIME", "sync") if self.mode != "webhook" else "sync"
+        self.database = MongoDB(async_pool=self.runtime == "async")
+        self.database.clear_placeholder_nicknames()
+        self.indexes = IndexManager(self.database)
+        self.indexes.ensure_indexes()
+        self.database.rebuild_ranking()
+        # Sync handlers run on shards keyed by sender: one user's updates in order, different users in parallel
+        self.executor = ShardedExecutor(int(getenv("BOT_SHARDS", 16)), name="update-shard")
+        self.telegram = TelegramClient(getenv("BOT_TOKEN"), self.executor)
+        self.bot = self.telegram.bot
+        self.scheduler = JobScheduler(self.database)
+        self.database.ledger.ensure_snapshot()
+        self.database.ledger.setup_scheduler(self.scheduler)
+        self.handlers = Handlers(self.bot, self.database, self.scheduler)
+        self.handlers.farm.warm_cooldowns()
+        self.access = AccessControl(self.database)
+        self.admin_handlers = AdminHandler(self.telegram, self.database, self.handlers.broadcaster, self.access, self.scheduler)
+        # Broadcast queries depend on the registered kinds, e.g. the bank's debt reminders
+        self.indexes.check_hot_queries(self.handlers.broadcaster.hot_queries())
+        self.party = Party(self.bot, self.database)
+        self.router = Router(self.access)
         
     def run_bot(self):
-        self.party.setup_party_handlers()
-        self.admin_handlers.setup_admin_handler()
-        self.bot.add_custom_filter(AccessLevel())
-        self.handlers.setup_handlers()
+        self.party.setup_party_handlers(self.router)
+        self.admin_handlers.setup_admin_handler(self.router)
+        self.handlers.setup_handlers(self.router)
+        self.router.register(self.bot)
         self.handlers.set_commands()
-        self.bot.infinity_polling(skip_pending=True)
+        self.handlers.broadcaster.resume_pending()
+        self.scheduler.start()
+        if self.mode == "webhook":
+            self.run_webhook()
+        elif self.runtime == "async":
+            # Imported here so the sync runtime does not need aiohttp
+            from async_runtime import AsyncRuntime
+            AsyncRuntime(self.telegram, self.database, self.handlers, self.router, self.executor).run()
+        else:
+            self.bot.infinity_polling(skip_pending=True)
+
+    def run_webhook(self):
+        """ Receive updates through a webhook served by a local HTTP server """
+        self.webhook = WebhookServer(self.bot)
+        self.bot.remove_webhook()
+        self.bot.set_webhook(url=getenv("WEBHOOK_URL"), secret_token=self.webhook.secret_token)
+        self.webhook.serve_forever()
         
 bot = Bot()
 bot.run_bot()
\ No newline at end of file
@@ -1,10 +1,11 @@
-from database import MongoDB
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from os import getenv
 
 class Party:
-    def __init__(self, bot):
-        self.database = MongoDB()
+    def __init__(self, bot, database):
+        self.database = database
         self.bot = bot
+        self.owner = getenv("ADMIN_ID")
         
     def create_party(self, party_name, party_creator):
         """ Create party in the database """
@@ -69,13 +70,15 @@ class Party:
         if user_coins < cost:
             return f"❌ У вас недостаточно монет для покупки {amount} кг гречки! Требуется {cost} монет, а у вас только {user_coins} монет."
         
+        user = self.database.apply_delta(party_creator_id, {"coins": -cost}, {"coins": {"$gte": cost}}, reason="grechka")
+        if user is None:
+            return f"❌ У вас недостаточно монет для покупки {amount} кг гречки! Требуется {cost} монет."
+        new_user_coins = user["coins"]
+        
         current_grechka = party.get("grechka", 0)
         new_grechka = current_grechka + amount
         self.database.update_party(party["party_name"], grechka=new_grechka)
         
-        new_user_coins = user_coins - cost
-        self.database.update_user(party_creator_id, {"coins": new_user_coins})
-        
         return f"✅ Вы успешно купили {amount} кг гречки для партии {party['party_name']}! Всего в партии теперь {new_grechka} кг. Ваш новый баланс: {new_user_coins} монет."
     
     def distribute_grechka_to_all(self, party_creator_id, amount_per_user):
@@ -90,9 +93,8 @@ class Party:
         
         current_party_grechka = party.get("grechka", 0)
         
-        # Получаем всех пользователей
-        users = self.database.find_users()
-        total_users = len(users)
+        # Считаем пользователей без загрузки документов
+        total_users = self.database.count_users()
         
         # Проверяем, хватает ли гречки на всех пользователей
         required_grechka = amount_per_user * total_users
@@ -100,14 +102,12 @@ class Party:
         if current_party_grechka < required_grechka:
             return f"❌ У вас недостаточно гречки для раздачи по {amount_per_user} кг каждому пользователю! У вас всего {current_party_grechka} кг, а для всех пользователей нужно {required_grechka} кг."
         
-        # Раздаем гречку всем пользователям
-        for user in users:
-            user_id = user["user_id"]
-            current_grechka = user.get("grechka", 0)
-            new_grechka = current_grechka + amount_per_user
-            
-            # Обновляем количество гречки у пользователя
-            self.database.update_user(user_id, {"grechka": new_grechka})
+        # Раздаем гречку всем пользователям одним update_many
+        report = self.database.inc_all_users("grechka", {"grechka": amount_per_user})
+        self.bot.send_message(self.owner, report.summary())
+        if report.errors:
+            return "❌ Раздача гречки прервана ошибкой базы данных, гречка партии не списана. Отчёт отправлен администратору."
+        required_grechka = amount_per_user * report.modified
         
         # Уменьшаем гречку у владельца партии
         new_party_grechka = current_party_grechka - required_grechka
@@ -115,8 +115,7 @@ class Party:
         
         return f"✅ Раздано {required_grechka} кг гречки всем пользователям! Каждый пользователь получил по {amount_per_user} кг. У владельца партии теперь {new_party_grechka} кг."
         
-    def setup_party_handlers(self):
-        @self.bot.message_handler(func=lambda message: message.text.lower().startswith("!создать"))
+    def setup_party_handlers(self, router):
         def create_party_handler(message):
             parts = message.text.split(maxsplit=1)  # Разбиваем по первому пробелу
             if len(parts) != 2:
@@ -134,7 +133,6 @@ class Party:
             result = self.create_party(party_name, party_creator)
             self.bot.reply_to(message, result)
             
-        @self.bot.message_handler(func=lambda message: message.reply_to_message and message.text.lower() == "!пригласить")
         def invite_reply_handler(message):
             """ Обработчик приглашения в партию (ответом на сообщение) """
             replied_user_id = message.reply_to_message.from_user.id  # ID приглашённого
@@ -166,7 +164,6 @@ class Party:
             self.bot.edit_message_text("❌ Вы отклонили приглашение в партию.", call.message.chat.id, call.message.message_id)
             self.bot.answer_callback_query(call.id, "Приглашение отклонено.")
             
-        @self.bot.message_handler(func=lambda message: message.reply_to_message and message.text.lower() == "!выгнать")
         def remove_party_member_reply_handler(message):
             replied_user_id = message.reply_to_message.from_user.id
             party_creator_id = message.from_user.id
@@ -179,7 +176,6 @@ class Party:
             result = self.remove_party_member(party_name, replied_user_id)
             self.bot.reply_to(message, result)
         
-        @self.bot.message_handler(func=lambda message: message.text.lower().startswith("!найти"))
         def get_party_handler(message):
             parts = message.text.split(maxsplit=1)  # Разделяем сообщение
             if len(parts) != 2:
@@ -188,7 +184,6 @@ class Party:
             party_name = parts[1]  # Берём всё, что идёт после "!партия"
             self.get_party(party_name, message)
             
-        @self.bot.message_handler(func=lambda message: message.text.lower().startswith("!гречка купить"))
         def buy_grechka_handler(message):
             parts = message.text.split(maxsplit=2)
             if len(parts) != 3:
@@ -203,7 +198,6 @@ class Party:
             result = self.buy_grechka(party_creator_id, amount)
             self.bot.reply_to(message, result)
             
-        @self.bot.message_handler(func=lambda message: message.text.lower().startswith("!гречка раздать"))
         def distribute_grechka_handler(message):
             """ Обработчик для раздачи гречки всем пользователям """
             parts = message.text.split(maxsplit=2)
@@ -219,4 +213,10 @@ class Party:
             result = self.distribute_grechka_to_all(party_creator_id, amount_per_user)
             self.bot.reply_to(message, result)
                 
-        print("✅ Party handlers are ready")
\ No newline at end of file
+        router.prefix("!создать", create_party_handler)
+        router.text("!пригласить", invite_reply_handler, reply=True)
+        router.text("!выгнать", remove_party_member_reply_handler, reply=True)
+        router.prefix("!найти", get_party_handler)
+        router.prefix("!гречка купить", buy_grechka_handler)
+        router.prefix("!гречка раздать", distribute_grechka_handler)
+        print("✅ Party handlers are ready")
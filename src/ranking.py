@@ -0,0 +1,131 @@
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+import threading
+
+
+class RankingIndex:
+    """ Live in-memory ranking of users by coins and debt, kept current by every balance write.
+    Every write to a user increments the document's version; a document older than the one the
+    index holds is ignored, so writes applied out of order cannot leave a stale value.
+    Users in exclude (e.g. the budget account, whose coins live in the treasury) are never ranked """
+    def __init__(self, fields=('coins', 'debt'), exclude=()):
+        self.fields = fields
+        self.exclude = frozenset(exclude)
+        self.ready = False
+        self._lock = threading.Lock()
+        # Held by update() and by a write to every user until its shift_all
+        self._updates = threading.RLock()
+        self._nicknames = {}
+        self._versions = {}
+        self._values = {field: {} for field in fields}
+        # Sorted lists of (-value, user_id): index 0 is the largest value
+        self._sorted = {field: [] for field in fields}
+
+    def rebuild(self, users):
+        """ Rebuild the whole index from an iterable of user dictionaries in one pass """
+        nicknames = {}
+        versions = {}
+        values = {field: {} for field in self.fields}
+        for user in users:
+            user_id = user.get('user_id')
+            if user_id is None or user_id in self.exclude:
+                continue
+            nicknames[user_id] = user.get('nickname')
+            versions[user_id] = user.get('version')
+            for field in self.fields:
+                values[field][user_id] = user.get(field) or 0
+        with self._lock:
+            # Users written while the rebuild was reading keep their newer values
+            for user_id, version in self._versions.items():
+                if version is not None and (versions.get(user_id) or 0) < version:
+                    nicknames[user_id] = self._nicknames.get(user_id)
+                    versions[user_id] = version
+                    for field in self.fields:
+                        values[field][user_id] = self._values[field].get(user_id, 0)
+            self._nicknames = nicknames
+            self._versions = versions
+            self._values = values
+            self._sorted = {
+                field: sorted((-value, user_id) for user_id, value in values[field].items())
+                for field in self.fields
+            }
+            self.ready = True
+
+    def update(self, user):
+        """ Apply a (possibly partial) user document after a write. Returns False if the document
+        is not newer than the one applied last, in which case the caller should re-read the user """
+        user_id = user.get('user_id')
+        if user_id is None or user_id in self.exclude:
+            return True
+        version = user.get('version')
+        with self._updates, self._lock:
+            if version is not None:
+                if user_id in self._versions and version <= (self._versions[user_id] or 0):
+                    return False
+                self._versions[user_id] = version
+            if 'nickname' in user:
+                self._nicknames[user_id] = user['nickname']
+            for field in self.fields:
+                if field in user:
+                    self._set(field, user_id, user[field] or 0)
+        return True
+
+    @contextmanager
+    def writing_all(self):
+        """ Hold back update() while the caller writes to every user and calls shift_all, so a
+        document written after that write is applied after the shift, not shifted twice """
+        with self._updates:
+            yield
+
+    def shift_all(self, deltas):
+        """ Add the same deltas to every user's fields after one write to every user, which also
+        incremented each version; the order does not change """
+        with self._updates, self._lock:
+            for user_id, version in self._versions.items():
+                self._versions[user_id] = (version or 0) + 1
+            for field, delta in deltas.items():
+                if field not in self.fields:
+                    continue
+                values = self._values[field]
+                for user_id in values:
+                    values[user_id] += delta
+                self._sorted[field] = [(negative_value - delta, user_id) for negative_value, user_id in self._sorted[field]]
+
+    def top(self, field, limit=10, exclude=(), positive=False):
+        """ Top users by field. Returns list of dictionaries with user_id, nickname and field """
+        result = []
+        with self._lock:
+            for negative_value, user_id in self._sorted[field]:
+                if positive and negative_value >= 0:
+                    break
+                if not user_id or user_id in exclude:
+                    continue
+                result.append({'user_id': user_id, 'nickname': self._nicknames.get(user_id), field: -negative_value})
+                if len(result) == limit:
+                    break
+        return result
+
+    def rank(self, field, user_id):
+        """ Competition rank of the user by field (1 is the largest value).
+        Returns tuple (rank, value, total) or None if the user is unknown """
+        with self._lock:
+            value = self._values[field].get(user_id)
+            if value is None:
+                return None
+            # (-value,) sorts before every (-value, user_id), so this counts strictly larger values
+            ahead = bisect_left(self._sorted[field], (-value,))
+            return ahead + 1, value, len(self._sorted[field])
+
+    def _set(self, field, user_id, value):
+        """ Move one user to the position of their new value """
+        values = self._values[field]
+        ordered = self._sorted[field]
+        old = values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            index = bisect_left(ordered, (-old, user_id))
+            if index < len(ordered) and ordered[index] == (-old, user_id):
+                del ordered[index]
+        values[user_id] = value
+        insort(ordered, (-value, user_id))
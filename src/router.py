@@ -0,0 +1,84 @@
+class Router:
+    """ Dispatches text messages through precompiled tables instead of a chain of filter lambdas.
+    /commands and ! prefix commands are found by dict lookup, conversation steps by a single state
+    lookup, and messages that match no route are dropped before any handler or database access """
+    def __init__(self, access):
+        self.access = access
+        self.commands = {}
+        self.prefixes = {}
+        self.max_prefix_words = 0
+        self.texts = {}
+        self.state_handlers = {}
+        self.states = {}
+        self.routed = 0
+        self.unrouted = 0
+        self.denied = 0
+
+    def command(self, name, handler, access_level=None):
+        """ Route /name (and /name@bot) to handler, optionally only for the given access levels """
+        self.commands[name] = (handler, access_level)
+
+    def prefix(self, words, handler):
+        """ Route messages whose first words are words (case-insensitive), e.g. "!гречка купить" """
+        key = tuple(words.lower().split())
+        self.prefixes[key] = handler
+        self.max_prefix_words = max(self.max_prefix_words, len(key))
+
+    def text(self, text, handler, reply=False):
+        """ Route messages equal to text (case-insensitive). reply=True only matches replies """
+        self.texts[text.lower()] = (handler, reply)
+
+    def state(self, name, handler):
+        """ Route any other message of a user in conversation state name to handler """
+        self.state_handlers[name] = handler
+
+    def set_state(self, user_id, name):
+        self.states[user_id] = name
+
+    def clear_state(self, user_id):
+        self.states.pop(user_id, None)
+
+    def resolve(self, message):
+        """ Find the route for a message. Returns (handler, access_level) or None """
+        text = message.text
+        if not text:
+            return None
+
+        if text.startswith('/'):
+            route = self.commands.get(text.split(maxsplit=1)[0][1:].split('@')[0])
+            if route:
+                return route
+
+        lowered = text.lower()
+        route = self.texts.get(lowered)
+        if route and (not route[1] or message.reply_to_message):
+            return route[0], None
+
+        # A conversation step takes any text, including one starting with a prefix such as "кузьма"
+        state = self.states.get(message.from_user.id)
+        if state is not None:
+            return self.state_handlers[state], None
+
+        words = lowered.split(maxsplit=self.max_prefix_words)
+        for length in range(min(len(words), self.max_prefix_words), 0, -1):
+            handler = self.prefixes.get(tuple(words[:length]))
+            if handler:
+                return handler, None
+        return None
+
+    def dispatch(self, message):
+        """ Run the handler of the message's route, if any and if the sender may use it """
+        route = self.resolve(message)
+        if route is None:
+            self.unrouted += 1
+            return
+        handler, access_level = route
+        if access_level and not self.access.check(message, access_level):
+            self.denied += 1
+            return
+        self.routed += 1
+        handler(message)
+
+    def register(self, bot):
+        """ Make the router the bot's only text message handler """
+        bot.register_message_handler(self.dispatch, func=lambda message: True)
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+from os import getenv
+import os
+import socket
+import threading
+import time
+
+from apscheduler.jobstores.mongodb import MongoDBJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from pymongo.errors import DuplicateKeyError
+
+
+def run_job(job_id):
+    """ Entry point stored with every persistent job; the callable itself lives in memory """
+    JobScheduler.current._run(job_id)
+
+
+class JobScheduler:
+    """ The bot's only scheduler. Job definitions persist in Mongo so missed runs are coalesced
+    into one after a restart, and a lease in the job_leases collection makes sure only one
+    bot replica runs each job """
+    current = None
+
+    def __init__(self, database):
+        self.database = database
+        self.leases = database.db['job_leases']
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': MongoDBJobStore(database=database.db.name, collection='jobs', client=database.client)},
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': None},
+            timezone=getenv("SCHEDULER_TIMEZONE", "UTC"),
+        )
+        self.jobs = {}
+        self.metrics = {}
+        self._lock = threading.Lock()
+        JobScheduler.current = self
+
+    def add(self, job_id, function, trigger, lease=300):
+        """ Define a job. function runs on trigger at most once per lease seconds across replicas """
+        self.jobs[job_id] = (function, trigger, lease)
+        self.metrics[job_id] = {
+            'runs': 0, 'failures': 0, 'skipped': 0, 'total_duration': 0.0,
+            'last_run_at': None, 'last_duration': None, 'last_error': None,
+        }
+
+    def start(self):
+        """ Start the scheduler, keeping the stored next run time of jobs whose trigger is unchanged """
+        self.scheduler.start(paused=True)
+        for job_id, (_, trigger, _) in self.jobs.items():
+            stored = self.scheduler.get_job(job_id)
+            if stored is None or str(stored.trigger) != str(trigger):
+                self.scheduler.add_job(run_job, trigger, args=[job_id], id=job_id, name=job_id, replace_existing=True)
+        for stored in self.scheduler.get_jobs():
+            if stored.id not in self.jobs:
+                self.scheduler.remove_job(stored.id)
+        self.scheduler.resume()
+
+    def _run(self, job_id):
+        function, _, lease = self.jobs[job_id]
+        metrics = self.metrics[job_id]
+        if not self._acquire(job_id, lease):
+            with self._lock:
+                metrics['skipped'] += 1
+            return
+
+        started = time.monotonic()
+        error = None
+        try:
+            function()
+        except Exception as e:
+            error = str(e)
+            print(f"Job {job_id} failed: {e}")
+        duration = time.monotonic() - started
+        with self._lock:
+            metrics['runs'] += 1
+            metrics['failures'] += error is not None
+            metrics['total_duration'] += duration
+            metrics['last_run_at'] = datetime.now(timezone.utc)
+            metrics['last_duration'] = duration
+            metrics['last_error'] = error
+
+    def _acquire(self, job_id, lease):
+        """ Take the job's lease unless another replica holds an unexpired one. Returns boolean """
+        now = datetime.now(timezone.utc)
+        try:
+            self.leases.find_one_and_update(
+                {'_id': job_id, 'expires_at': {'$lte': now}},
+                {'$set': {'owner': self.owner, 'acquired_at': now, 'expires_at': now + timedelta(seconds=lease)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def summary(self):
+        """ Schedule and run metrics of every job. Returns string """
+        lines = []
+        with self._lock:
+            for job_id, metrics in self.metrics.items():
+                stored = self.scheduler.get_job(job_id) if self.scheduler.running else None
+                next_run = stored.next_run_time.strftime('%Y-%m-%d %H:%M %Z') if stored and stored.next_run_time else "-"
+                last_run = metrics['last_run_at'].strftime('%Y-%m-%d %H:%M %Z') if metrics['last_run_at'] else "never"
+                average = metrics['total_duration'] / metrics['runs'] if metrics['runs'] else 0.0
+                line = (
+                    f"{job_id}: next {next_run}, last {last_run}, runs {metrics['runs']}, "
+                    f"failed {metrics['failures']}, skipped {metrics['skipped']}, avg {average:.2f} s"
+                )
+                if metrics['last_duration'] is not None:
+                    line += f", last {metrics['last_duration']:.2f} s"
+                if metrics['last_error']:
+                    line += f"\n  last error: {metrics['last_error']}"
+                lines.append(line)
+        return "\n".join(lines) or "No jobs."
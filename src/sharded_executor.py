@@ -0,0 +1,131 @@
+from concurrent.futures import Future
+from os import getenv
+import queue
+import threading
+import time
+
+import telebot
+
+
+class Shard:
+    """ One worker thread with its own FIFO queue of at most maxsize tasks (0 is unbounded) """
+    def __init__(self, index, name, maxsize=0):
+        self.index = index
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.peak_depth = 0
+        self.full = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name=f"{name}-{index}", daemon=True)
+        self.thread.start()
+
+    def put(self, future, function, args, block=True):
+        """ Queue a task, waiting for room while the queue is full unless block is False,
+        in which case queue.Full is raised """
+        task = (time.monotonic(), future, function, args)
+        try:
+            self.queue.put_nowait(task)
+        except queue.Full:
+            with self._lock:
+                self.full += 1
+            if not block:
+                raise
+            self.queue.put(task)
+        with self._lock:
+            self.peak_depth = max(self.peak_depth, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            queued_at, future, function, args = self.queue.get()
+            started = time.monotonic()
+            failed = False
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                failed = True
+                print(f"Shard {self.index} task failed: {e}")
+                future.set_exception(e)
+            finished = time.monotonic()
+            with self._lock:
+                self.processed += 1
+                self.failed += failed
+                self.total_wait += started - queued_at
+                self.total_run += finished - started
+                self.max_latency = max(self.max_latency, finished - queued_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shard': self.index,
+                'depth': self.queue.qsize(),
+                'peak_depth': self.peak_depth,
+                'full': self.full,
+                'processed': self.processed,
+                'failed': self.failed,
+                'avg_wait_ms': self.total_wait / self.processed * 1000 if self.processed else 0.0,
+                'avg_run_ms': self.total_run / self.processed * 1000 if self.processed else 0.0,
+                'max_latency_ms': self.max_latency * 1000,
+            }
+
+
+class ShardedExecutor:
+    """ Runs tasks on a fixed set of shards. Tasks with the same key always go to the same shard,
+    so one user's updates run one at a time in arrival order while different users run in parallel.
+    Shard queues hold BOT_SHARD_QUEUE_SIZE tasks; a full shard holds up whoever submits to it """
+    def __init__(self, shards, name="shard"):
+        queue_size = int(getenv("BOT_SHARD_QUEUE_SIZE", 100))
+        self.shards = [Shard(index, name, queue_size) for index in range(shards)]
+
+    def submit(self, key, function, *args):
+        """ Queue function(*args) on the shard of key, waiting while the shard is full.
+        Returns concurrent.futures.Future """
+        future = Future()
+        self.shards[hash(key) % len(self.shards)].put(future, function, args)
+        return future
+
+    def submit_nowait(self, key, function, *args):
+        """ Like submit, but raises queue.Full instead of waiting for room """
+        future = Future()
+        self.shards[hash(key) % len(self.shards)].put(future, function, args, block=False)
+        return future
+
+    def stats(self):
+        """ Per-shard queue depth and latency. Returns list of dictionaries """
+        return [shard.stats() for shard in self.shards]
+
+    def summary(self):
+        """ Shard report for the admin. Returns string """
+        lines = [
+            f"#{s['shard']}: depth {s['depth']} (peak {s['peak_depth']}, full {s['full']}x), {s['processed']} done, "
+            f"{s['failed']} failed, wait {s['avg_wait_ms']:.1f} ms, run {s['avg_run_ms']:.1f} ms, "
+            f"max {s['max_latency_ms']:.0f} ms"
+            for s in self.stats()
+        ]
+        return "\n".join(lines)
+
+
+def sender_id(update):
+    """ The user an update comes from, or its update_id when it has no sender """
+    for content in (update.message, update.edited_message, update.callback_query):
+        if content is not None and content.from_user is not None:
+            return content.from_user.id
+    return update.update_id
+
+
+class ShardedTeleBot(telebot.TeleBot):
+    """ TeleBot that processes each update on the shard of its sender instead of a shared pool """
+    def __init__(self, token, executor, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.executor = executor
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Polling asks for updates after last_update_id, so advance it before the update is handled
+            self.last_update_id = max(self.last_update_id, update.update_id)
+            # Waits while the shard is full: polling stops fetching and the webhook dispatcher stops taking
+            # updates, so the webhook queue fills and answers 503
+            self.executor.submit(sender_id(update), super().process_new_updates, [update])
@@ -0,0 +1,86 @@
+from os import getenv
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+from sharded_executor import ShardedTeleBot
+
+
+class TelegramClient:
+    """ The single outbound Telegram client: one TeleBot on a pooled keep-alive HTTP session,
+    with call counts and latency per Bot API method. Updates are handled on the executor's shards.
+    The async runtime's AsyncTeleBot comes from async_bot(), so its calls are counted here too """
+    def __init__(self, token, executor):
+        self.token = token
+        self.pool_size = int(getenv("TELEGRAM_POOL_SIZE", 32))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        apihelper.CONNECT_TIMEOUT = float(getenv("TELEGRAM_CONNECT_TIMEOUT", 5))
+        apihelper.READ_TIMEOUT = float(getenv("TELEGRAM_READ_TIMEOUT", 15))
+        apihelper.CUSTOM_REQUEST_SENDER = self._send
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executor = executor
+        self.bot = ShardedTeleBot(token, executor)
+
+    def _send(self, method, url, **kwargs):
+        """ Request sender used by telebot for every Bot API call """
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code != 200
+            return response
+        finally:
+            self._record(api_method, time.perf_counter() - started, failed)
+
+    def async_bot(self):
+        """ AsyncTeleBot whose Bot API calls, getUpdates included, go through the instrumented async sender """
+        # Imported here so the sync runtime does not need aiohttp
+        from telebot import asyncio_helper
+        from telebot.async_telebot import AsyncTeleBot
+
+        asyncio_helper.REQUEST_LIMIT = self.pool_size
+        process_request = asyncio_helper._process_request
+
+        async def send(token, url, method='get', params=None, files=None, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await process_request(token, url, method, params, files, **kwargs)
+                failed = False
+                return result
+            finally:
+                self._record(url, time.perf_counter() - started, failed)
+
+        # Every asyncio_helper call looks _process_request up at call time
+        asyncio_helper._process_request = send
+        return AsyncTeleBot(self.token)
+
+    def _record(self, api_method, seconds, failed):
+        with self._lock:
+            calls = self._calls.setdefault(api_method, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+            calls['count'] += 1
+            calls['errors'] += failed
+            calls['total'] += seconds
+            calls['max'] = max(calls['max'], seconds)
+
+    def stats(self):
+        """ Per-method call counts and latency, busiest first. Returns string """
+        with self._lock:
+            calls = sorted(self._calls.items(), key=lambda item: item[1]['total'], reverse=True)
+            lines = [
+                f"{api_method}: {c['count']} calls, {c['errors']} errors, "
+                f"avg {c['total'] / c['count'] * 1000:.0f} ms, max {c['max'] * 1000:.0f} ms, "
+                f"total {c['total']:.1f} s"
+                for api_method, c in calls
+            ]
+        return "\n".join(lines) or "No Telegram calls yet."
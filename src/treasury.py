@@ -0,0 +1,29 @@
+from os import getenv
+import random
+
+
+class Treasury:
+    """ The bot's budget as a striped counter. Income is added with $inc to one of TREASURY_STRIPES
+    documents in the treasury collection, so concurrent writers rarely contend on one document.
+    The total is the budget account's own coins plus every stripe """
+    ACCOUNT = 5587251063
+
+    def __init__(self, database):
+        self.database = database
+        self.collection = database.db['treasury']
+        self.stripes = int(getenv('TREASURY_STRIPES', 16))
+
+    def increment(self, amount):
+        """ update_one arguments that add amount to a random stripe. Returns (filter, update) """
+        return {'_id': random.randrange(self.stripes)}, {'$inc': {'coins': amount}}
+
+    def add(self, amount, reason):
+        """ Add amount (negative to spend) to the treasury, recording reason in the ledger """
+        self.collection.update_one(*self.increment(amount), upsert=True)
+        self.database.ledger.record(self.ACCOUNT, {'coins': amount}, reason)
+
+    def total(self):
+        """ Budget account coins plus every stripe. Returns integer """
+        account = self.database.find_user_id(self.ACCOUNT)
+        stripes = next(self.collection.aggregate([{'$group': {'_id': None, 'coins': {'$sum': '$coins'}}}]), None)
+        return (account['coins'] if account else 0) + (stripes['coins'] if stripes else 0)
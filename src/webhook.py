@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv
+import json
+import queue
+import threading
+import time
+
+from telebot.types import Update
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 resets connections when Telegram opens many at once
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """ Receives Telegram updates on a local HTTP server and hands them through a bounded queue
+    to one dispatcher thread. It passes updates on in arrival order, so the bot's per-user shards
+    see each user's updates in order; handlers run there, not here. Redelivered update_ids are dropped """
+    def __init__(self, bot, process=None):
+        self.process = process or bot.process_new_updates
+        self.host = getenv("WEBHOOK_HOST", "0.0.0.0")
+        self.port = int(getenv("WEBHOOK_PORT", 8443))
+        self.path = getenv("WEBHOOK_PATH", "/telegram")
+        self.secret_token = getenv("WEBHOOK_SECRET")
+        self.dedup_size = int(getenv("WEBHOOK_DEDUP_SIZE", 10000))
+        self.queue = queue.Queue(maxsize=int(getenv("WEBHOOK_QUEUE_SIZE", 1000)))
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.httpd = _HTTPServer((self.host, self.port), self._handler_class())
+
+    def serve_forever(self):
+        """ Start the dispatcher and serve webhook requests until shutdown() """
+        threading.Thread(target=self._dispatch, name="webhook-dispatcher", daemon=True).start()
+        print(f"Webhook listening on {self.host}:{self.httpd.server_address[1]}{self.path}")
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+    def accept(self, payload):
+        """ Deduplicate and enqueue one update. Returns HTTP status code for Telegram """
+        update_id = payload.get('update_id')
+        with self._lock:
+            self.received += 1
+            if update_id in self._seen:
+                self.duplicates += 1
+                return 200
+            self._seen[update_id] = True
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+        try:
+            self.queue.put_nowait((time.monotonic(), payload))
+        except queue.Full:
+            # Telegram redelivers after a non-2xx answer, so forget the id and let it retry
+            with self._lock:
+                self._seen.pop(update_id, None)
+                self.rejected += 1
+            return 503
+        return 200
+
+    def stats(self):
+        """ Ingestion counters and processing latency. Returns dictionary """
+        with self._lock:
+            return {
+                'received': self.received,
+                'duplicates': self.duplicates,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'queued': self.queue.qsize(),
+                'avg_latency_ms': self.total_latency / self.processed * 1000 if self.processed else 0.0,
+                'max_latency_ms': self.max_latency * 1000,
+            }
+
+    def _dispatch(self):
+        # A single consumer: with several, two updates of one user could reach the shards out of order.
+        # While a shard is full process() waits, so the queue fills and accept() answers 503
+        while True:
+            queued_at, payload = self.queue.get()
+            failed = False
+            try:
+                self.process([Update.de_json(payload)])
+            except Exception as e:
+                failed = True
+                print(f"Failed to process update {payload.get('update_id')}: {e}")
+            latency = time.monotonic() - queued_at
+            with self._lock:
+                self.processed += 1
+                self.failed += failed
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def _handler_class(self):
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._respond(404)
+                if server.secret_token and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret_token:
+                    return self._respond(403)
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError:
+                    return self._respond(400)
+                if not isinstance(payload, dict):
+                    return self._respond(400)
+                self._respond(server.accept(payload))
+
+            def _respond(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return WebhookHandler
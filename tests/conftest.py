@@ -0,0 +1,20 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+# The bot runs from src/ with top-level imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """ A MongoDB over an in-memory mongomock client. The ledger and balance history writer
+    threads stay idle, so the tests flush by hand """
+    from database import MongoDB
+
+    monkeypatch.setenv("LEDGER_FLUSH_INTERVAL", "3600")
+    monkeypatch.setenv("BALANCE_HISTORY_FLUSH_INTERVAL", "3600")
+    monkeypatch.setattr("database.MongoClient", lambda *args, **kwargs: mongomock.MongoClient())
+    return MongoDB()
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+
+def record_hourly(history, user_id, start, hours):
+    """ One coins sample per hour from start, 100 then 101, 102, ... """
+    for hour in range(hours):
+        history.record(user_id, {'coins': 100 + hour}, start + timedelta(hours=hour))
+    history.flush()
+
+
+def test_last_24_hours_cross_midnight(database):
+    history = database.balance_history
+    start = datetime(2026, 3, 9, 20, tzinfo=timezone.utc)
+    record_hourly(history, 1, start, 30)
+    now = datetime(2026, 3, 11, 1, 30, tzinfo=timezone.utc)
+
+    # 30 samples from 20:00 on the 9th: the last is 01:00 on the 11th
+    assert history.series(1, 'coins', 1, now) == list(range(106, 130))
+
+
+def test_hours_without_a_sample_carry_the_last_one(database):
+    history = database.balance_history
+    history.record(1, {'coins': 5}, datetime(2026, 3, 10, 12, tzinfo=timezone.utc))
+    history.record(1, {'coins': 8}, datetime(2026, 3, 11, 0, tzinfo=timezone.utc))
+    history.flush()
+    now = datetime(2026, 3, 11, 2, tzinfo=timezone.utc)
+
+    # 03:00 to 11:00 on the 10th come before the first sample and have no point
+    assert history.series(1, 'coins', 1, now) == [5] * 12 + [8] * 3
+
+
+def test_daily_points_are_the_end_of_each_day(database):
+    history = database.balance_history
+    record_hourly(history, 1, datetime(2026, 3, 9, 20, tzinfo=timezone.utc), 30)
+    now = datetime(2026, 3, 11, 1, 30, tzinfo=timezone.utc)
+
+    # The 9th ends at 23:00 (103), the 10th at 23:00 (127), the 11th so far at 01:00 (129)
+    assert history.series(1, 'coins', 3, now) == [103, 127, 129]
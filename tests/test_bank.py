@@ -0,0 +1,158 @@
+import random
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from bank import Bank
+from broadcast import Broadcaster
+
+HOUR = 3600
+
+
+class Registry:
+    """ Stands in for the broadcaster and the scheduler, which Bank only registers with, and the log sink """
+    def register(self, *args, **kwargs):
+        pass
+
+    def add(self, *args, **kwargs):
+        pass
+
+    def log(self, message):
+        pass
+
+
+@pytest.fixture
+def bank(monkeypatch):
+    monkeypatch.setenv("ADMIN_ID", "1")
+    return Bank(bot=None, database=None, log_sink=None, broadcaster=Registry(), scheduler=Registry())
+
+
+def hourly(bank, principal, hours):
+    """ Reference: compound one hour at a time without rounding """
+    for _ in range(hours):
+        principal *= 1 + bank.annual_rate / 24
+    return principal
+
+
+def settle(bank, user, now):
+    """ Apply Bank.settlement to a user dictionary the way apply_delta would """
+    settlement = bank.settlement(user, now)
+    if settlement is None:
+        return user
+    deltas, conditions, set_fields = settlement
+    assert all(user.get(field) == value for field, value in conditions.items())
+    user = dict(user)
+    for field, delta in deltas.items():
+        user[field] += delta
+    user.update(set_fields or {})
+    return user
+
+
+def test_accrue_catches_up_after_downtime(bank):
+    deposit, last_accrual_at = bank.accrue(100, 0, 720 * HOUR + 1800)
+    assert deposit == pytest.approx(hourly(bank, 100, 720))
+    # The unfinished hour keeps counting
+    assert last_accrual_at == 720 * HOUR
+
+
+def test_accrue_waits_for_a_whole_hour(bank):
+    assert bank.accrue(100, 0, HOUR - 1) == (100, 0)
+
+
+def test_hourly_settlement_matches_one_settlement(bank):
+    start = {'user_id': 1, 'deposit': 100, 'last_accrual_at': 0}
+    once = settle(bank, start, 720 * HOUR)
+
+    every_hour = start
+    for hour in range(1, 721):
+        every_hour = settle(bank, every_hour, hour * HOUR)
+
+    assert once['deposit'] == every_hour['deposit'] == round(hourly(bank, 100, 720))
+    assert once['last_accrual_at'] == every_hour['last_accrual_at'] == 720 * HOUR
+
+
+def test_irregular_settlements_match_one_settlement(bank):
+    rng = random.Random(7)
+    user = {'user_id': 1, 'deposit': 250, 'last_accrual_at': 0}
+    now = 0
+    while now < 500 * HOUR:
+        now += rng.randint(1, 5 * HOUR)
+        user = settle(bank, user, now)
+    reference = settle(bank, {'user_id': 1, 'deposit': 250, 'last_accrual_at': 0}, now)
+    assert user['deposit'] == reference['deposit']
+
+
+def test_legacy_deposit_starts_its_clock_on_first_settlement(bank):
+    user = settle(bank, {'user_id': 1, 'deposit': 100, 'last_accrual_at': None}, 10 * HOUR)
+    assert user['deposit'] == 100
+    assert user['last_accrual_at'] == 10 * HOUR
+
+    user = settle(bank, user, 34 * HOUR)
+    assert user['deposit'] == round(hourly(bank, 100, 24))
+
+
+def test_deposit_without_exact_value_compounds_from_the_deposit(bank):
+    # Written before deposit_exact existed, or by a path that does not maintain it
+    user = {'user_id': 1, 'deposit': 300, 'deposit_exact': 12.5, 'last_accrual_at': 0}
+    assert settle(bank, user, 24 * HOUR)['deposit'] == round(hourly(bank, 300, 24))
+
+
+def test_empty_deposit_has_nothing_to_settle(bank):
+    assert bank.settlement({'user_id': 1, 'deposit': 0, 'last_accrual_at': 0}, 100 * HOUR) is None
+
+
+def test_bulk_settlement_records_only_the_applied_requests(bank, database, monkeypatch):
+    bank.database = database
+    logged = []
+    monkeypatch.setattr(bank, 'log', logged.append)
+    users = database.users_collection
+    users.insert_many([{'user_id': user_id, 'deposit': 1000, 'last_accrual_at': 0} for user_id in (1, 2)])
+    iter_users = database.iter_users
+
+    def raced(filter=None, projection=None, **kwargs):
+        depositors = list(iter_users(filter, projection, **kwargs))
+        # User 2 deposits between the read and the bulk write, so its conditional request matches nothing
+        users.update_one({'user_id': 2, 'deposit': 1000}, {'$inc': {'deposit': 10}})
+        return iter(depositors)
+
+    monkeypatch.setattr(database, 'iter_users', raced)
+    monkeypatch.setattr('bank.time.time', lambda: 48 * HOUR)
+    bank.apply_interest_to_all_users()
+
+    assert users.find_one({'user_id': 1})['last_accrual_at'] == 48 * HOUR
+    assert users.find_one({'user_id': 2})['last_accrual_at'] == 0
+    database.ledger.flush()
+    assert [entry['user_id'] for entry in database.ledger.entries.find({'reason': 'interest'})] == [1]
+    database.balance_history.flush()
+    assert database.balance_history.collection.distinct('user_id') == [1]
+    assert logged[0].startswith("interest:")
+
+
+class RejectingBot:
+    """ Telegram refuses every message to the first user and accepts the rest """
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        if chat_id == 7:
+            raise ApiTelegramException('sendMessage', None, {'error_code': 400, 'description': 'Bad Request: wrong text'})
+        self.sent.append(chat_id)
+
+
+def test_failed_reminder_is_retried_by_the_next_run(database, monkeypatch):
+    monkeypatch.setenv("ADMIN_ID", "1")
+    monkeypatch.setenv("BROADCAST_CHAT_INTERVAL", "0")
+    bot = RejectingBot()
+    broadcaster = Broadcaster(bot, database, Registry())
+    monkeypatch.setattr(broadcaster, '_spawn', broadcaster._run)
+    Bank(bot, database, None, broadcaster, Registry())
+    for user_id in (7, 8):
+        database.users_collection.insert_one({'user_id': user_id, 'nickname': f'@{user_id}', 'name': 'Debtor', 'debt': 100})
+
+    broadcaster.start('debt_reminder')
+    assert database.users_collection.find_one({'user_id': 7})['last_reminded_at'] is None
+    assert database.users_collection.find_one({'user_id': 8})['last_reminded_at'] is not None
+
+    broadcaster.start('debt_reminder')
+    assert bot.sent == [8]
+    assert broadcaster.collection.find_one(sort=[('started_at', -1)])['failed'] == 1
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from broadcast import Broadcaster
+
+
+class LogSink:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def replicas(database, monkeypatch):
+    """ Two broadcasters sharing one database, as two bot replicas would """
+    replicas = []
+    for owner in ('a:1', 'b:2'):
+        broadcaster = Broadcaster(None, database, LogSink())
+        broadcaster.owner = owner
+        broadcaster.register('text', lambda job, user: job['text'])
+        broadcaster.spawned = []
+        monkeypatch.setattr(broadcaster, '_spawn', broadcaster.spawned.append)
+        replicas.append(broadcaster)
+    return replicas
+
+
+def running_job(collection, **fields):
+    return collection.insert_one({
+        'kind': 'text', 'text': 'hi', 'status': 'running', 'last_user_id': 5,
+        'sent': 0, 'failed': 0, 'blocked': 0, 'skipped': 0, **fields,
+    }).inserted_id
+
+
+def test_only_one_replica_resumes_a_broadcast(replicas):
+    first, second = replicas
+    expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+    job_id = running_job(first.collection, owner='c:3', lease_until=expired)
+    legacy_id = running_job(first.collection)
+
+    first.resume_pending()
+    second.resume_pending()
+
+    assert {job['_id'] for job in first.spawned} == {job_id, legacy_id}
+    assert second.spawned == []
+    assert first.collection.count_documents({'owner': 'a:1'}) == 2
+
+
+def test_a_held_lease_is_not_taken_over(replicas):
+    first, _ = replicas
+    running_job(first.collection, owner='c:3', lease_until=datetime.now(timezone.utc) + timedelta(minutes=1))
+    first.resume_pending()
+    assert first.spawned == []
+
+
+def test_replica_that_lost_its_lease_stops_at_the_checkpoint(database, replicas):
+    first, _ = replicas
+    database.users_collection.insert_many([{'user_id': user_id, 'nickname': f'@{user_id}'} for user_id in (6, 7)])
+    job_id = running_job(first.collection, owner='b:2', lease_until=datetime.now(timezone.utc))
+    first._deliver = lambda job, kind, user: 'sent'
+
+    first._run(first.collection.find_one({'_id': job_id}))
+
+    job = first.collection.find_one({'_id': job_id})
+    assert (job['status'], job['sent'], job['last_user_id']) == ('running', 0, 5)
+    assert "taken over" in first.log_sink.messages[-1]
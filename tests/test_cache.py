@@ -0,0 +1,18 @@
+from cache import TTLCache
+
+
+def test_older_version_does_not_replace_the_cached_value():
+    cache = TTLCache(10, 60)
+    cache.put(1, {'coins': 50, 'version': 5}, 5)
+    # A read from before the write finishes after it
+    cache.put(1, {'coins': 20, 'version': 4}, 4)
+    assert cache.get(1)['coins'] == 50
+    cache.put(1, {'coins': 60, 'version': 6}, 6)
+    assert cache.get(1)['coins'] == 60
+
+
+def test_unversioned_values_replace_each_other():
+    cache = TTLCache(10, 60)
+    cache.put('@a', 1)
+    cache.put('@a', 2)
+    assert cache.get('@a') == 2
@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+import time
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+
+@pytest.fixture
+def ledger(database):
+    ledger = database.ledger
+    ledger.snapshot_lag = 0
+    ledger.state.insert_one({'_id': 'snapshot', 'generation': 0, 'cutoff': datetime.now(timezone.utc)})
+    ledger.snapshots.insert_one({'generation': 0, 'user_id': 7, 'coins': 10, 'deposit': 0, 'debt': 0, 'grechka': 0})
+    return ledger
+
+
+def test_entry_inserted_after_the_cutoff_reaches_the_next_snapshot(ledger, monkeypatch):
+    ledger.record(7, {'coins': 5}, 'farm')
+    insert_many = ledger.entries.insert_many
+
+    def unreachable(*args, **kwargs):
+        raise AutoReconnect("down")
+
+    # The snapshot's own flush fails, so the entry is inserted after a cutoff later than its ts
+    monkeypatch.setattr(ledger.entries, 'insert_many', unreachable)
+    ledger.snapshot()
+    monkeypatch.setattr(ledger.entries, 'insert_many', insert_many)
+    # Dates are stored to the millisecond; the snapshot lag does this in production
+    time.sleep(0.01)
+    ledger.flush()
+    assert ledger.balance(7)['coins'] == 15
+
+    ledger.snapshot()
+    assert ledger.snapshots.find_one({'generation': 2, 'user_id': 7})['coins'] == 15
+    assert ledger.balance(7)['coins'] == 15
+
+
+def test_buffer_drops_the_oldest_entries_past_its_bound(ledger):
+    ledger.max_buffered = 3
+    for amount in range(1, 6):
+        ledger.record(7, {'coins': amount}, 'farm')
+    ledger.flush()
+    assert [entry['delta']['coins'] for entry in ledger.entries.find()] == [3, 4, 5]
+    assert ledger.dropped == 2
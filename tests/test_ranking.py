@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from ranking import RankingIndex
+
+
+def full_sort(users, field, exclude=(), positive=False):
+    """ Reference: what a full scan plus sorted() would answer """
+    ordered = sorted(users.values(), key=lambda user: (-user[field], user['user_id']))
+    return [
+        {'user_id': user['user_id'], 'nickname': user['nickname'], field: user[field]}
+        for user in ordered
+        if user['user_id'] and user['user_id'] not in exclude and (not positive or user[field] > 0)
+    ]
+
+
+def full_rank(users, field, user_id):
+    value = users[user_id][field]
+    return sum(1 for user in users.values() if user[field] > value) + 1, value, len(users)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_ranking_agrees_with_a_full_sort(seed):
+    rng = random.Random(seed)
+    users = {
+        user_id: {'user_id': user_id, 'nickname': f"@user{user_id}", 'coins': rng.randint(-50, 50), 'debt': rng.randint(0, 20)}
+        for user_id in range(rng.randint(1, 60))
+    }
+    ranking = RankingIndex()
+    ranking.rebuild(dict(user) for user in users.values())
+
+    for _ in range(300):
+        operation = rng.random()
+        if operation < 0.6:
+            # A balance write: a full user document after apply_delta or a partial update_user
+            user_id = rng.randrange(len(users) + 5)
+            if user_id not in users:
+                # New users arrive through add_user with their whole document
+                users[user_id] = {'user_id': user_id, 'nickname': f"@user{user_id}", 'coins': 0, 'debt': 0}
+                ranking.update(dict(users[user_id]))
+            user = users[user_id]
+            field = rng.choice(('coins', 'debt'))
+            user[field] = rng.choice((user[field], user[field] + rng.randint(-30, 30), rng.randint(-5, 5)))
+            ranking.update(dict(user) if rng.random() < 0.5 else {'user_id': user_id, field: user[field]})
+        elif operation < 0.7:
+            field, delta = rng.choice(('coins', 'debt')), rng.randint(-20, 20)
+            for user in users.values():
+                user[field] += delta
+            ranking.shift_all({field: delta})
+
+        field = rng.choice(('coins', 'debt'))
+        exclude = {rng.randrange(len(users))}
+        positive = rng.random() < 0.5
+        limit = rng.randint(1, 15)
+        assert ranking.top(field, limit, exclude=exclude, positive=positive) == full_sort(users, field, exclude, positive)[:limit]
+        user_id = rng.choice(list(users))
+        assert ranking.rank(field, user_id) == full_rank(users, field, user_id)
+
+
+def test_unknown_user_has_no_rank():
+    ranking = RankingIndex()
+    ranking.rebuild([{'user_id': 1, 'nickname': '@a', 'coins': 5, 'debt': 0}])
+    assert ranking.rank('coins', 2) is None
+
+
+def test_older_document_is_ignored():
+    ranking = RankingIndex()
+    ranking.rebuild([{'user_id': 1, 'nickname': '@a', 'coins': 5, 'debt': 0, 'version': 3}])
+    assert ranking.update({'user_id': 1, 'coins': 50, 'version': 5})
+    # A write that finished earlier but reached the index later
+    assert not ranking.update({'user_id': 1, 'coins': 20, 'version': 4})
+    assert ranking.rank('coins', 1) == (1, 50, 1)
+
+
+def test_document_written_after_a_write_to_everyone_is_not_shifted_again():
+    ranking = RankingIndex()
+    ranking.rebuild([
+        {'user_id': 1, 'nickname': '@a', 'coins': 5, 'debt': 0, 'version': 3},
+        {'user_id': 2, 'nickname': '@b', 'coins': 10, 'debt': 0, 'version': 1},
+    ])
+    # update_many gave everyone +1000; user 1 then farmed 7 before the shift reached the index
+    with ranking.writing_all():
+        ranking.shift_all({'coins': 1000})
+    assert ranking.update({'user_id': 1, 'coins': 1012, 'version': 5})
+    assert ranking.top('coins') == [
+        {'user_id': 1, 'nickname': '@a', 'coins': 1012},
+        {'user_id': 2, 'nickname': '@b', 'coins': 1010},
+    ]
+    # A farm written before the update_many is older than the shifted value: the caller re-reads
+    assert not ranking.update({'user_id': 2, 'coins': 17, 'version': 2})
+
+
+def test_rebuild_keeps_users_written_while_it_read():
+    ranking = RankingIndex()
+    ranking.rebuild([{'user_id': 1, 'nickname': '@a', 'coins': 5, 'debt': 0, 'version': 1}])
+    ranking.update({'user_id': 1, 'nickname': '@a', 'coins': 9, 'debt': 0, 'version': 3})
+    ranking.rebuild([{'user_id': 1, 'nickname': '@a', 'coins': 7, 'debt': 0, 'version': 2}])
+    assert ranking.rank('coins', 1) == (1, 9, 1)
+
+
+def test_excluded_users_are_never_ranked():
+    ranking = RankingIndex(exclude={99})
+    ranking.rebuild([
+        {'user_id': 1, 'nickname': '@a', 'coins': 5, 'debt': 0},
+        {'user_id': 99, 'nickname': '@budget', 'coins': 500, 'debt': 0},
+    ])
+    ranking.update({'user_id': 99, 'coins': 700})
+    assert ranking.top('coins') == [{'user_id': 1, 'nickname': '@a', 'coins': 5}]
+    assert ranking.rank('coins', 99) is None
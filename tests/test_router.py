@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+from router import Router
+
+
+def message(text, user_id=7):
+    return SimpleNamespace(text=text, from_user=SimpleNamespace(id=user_id), reply_to_message=None)
+
+
+def test_conversation_state_comes_before_prefixes():
+    router = Router(access=None)
+    router.command('amnisty', 'request_amnesty')
+    router.prefix("кузьма", 'forward_to_admin')
+    router.state('amnesty_reason', 'collect_amnesty_reason')
+    router.set_state(7, 'amnesty_reason')
+
+    assert router.resolve(message("кузьма прости долг")) == ('collect_amnesty_reason', None)
+    assert router.resolve(message("/amnisty")) == ('request_amnesty', None)
+    assert router.resolve(message("кузьма прости долг", user_id=8)) == ('forward_to_admin', None)
+
+    router.clear_state(7)
+    assert router.resolve(message("кузьма прости долг")) == ('forward_to_admin', None)
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from sharded_executor import ShardedExecutor
+from webhook import WebhookServer
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setenv("BOT_SHARD_QUEUE_SIZE", "1")
+    return ShardedExecutor(1)
+
+
+def test_full_shard_rejects_nowait_and_holds_up_submit(executor, gate):
+    executor.submit(0, gate.wait)
+    wait_until(lambda: executor.shards[0].queue.empty())
+    executor.submit(0, gate.wait)
+    with pytest.raises(queue.Full):
+        executor.submit_nowait(0, gate.wait)
+
+    submitted = threading.Event()
+    threading.Thread(target=lambda: (executor.submit(0, gate.wait), submitted.set()), daemon=True).start()
+    assert not submitted.wait(0.1)
+    gate.set()
+    assert submitted.wait(2)
+    assert executor.stats()[0]['full'] == 2
+
+
+def test_full_shard_makes_the_webhook_answer_503(executor, gate, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PORT", "0")
+    monkeypatch.setenv("WEBHOOK_QUEUE_SIZE", "1")
+    webhook = WebhookServer(None, process=lambda updates: executor.submit(0, gate.wait))
+    threading.Thread(target=webhook._dispatch, daemon=True).start()
+    try:
+        # One update runs on the shard, one waits in it and one holds the dispatcher in submit
+        for update_id in range(3):
+            assert webhook.accept({'update_id': update_id}) == 200
+            wait_until(webhook.queue.empty)
+            if update_id == 0:
+                wait_until(executor.shards[0].queue.empty)
+        wait_until(lambda: executor.stats()[0]['full'] == 1)
+        assert webhook.accept({'update_id': 3}) == 200
+        assert webhook.accept({'update_id': 4}) == 503
+    finally:
+        webhook.httpd.server_close()
+
+
+def test_webhook_keeps_one_users_updates_in_order(monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PORT", "0")
+    executor = ShardedExecutor(4)
+    handled = []
+    webhook = WebhookServer(None, process=lambda updates: [
+        executor.submit(update.update_id % 2, lambda update_id=update.update_id: handled.append(update_id))
+        for update in updates
+    ])
+    threading.Thread(target=webhook._dispatch, daemon=True).start()
+    try:
+        for update_id in range(200):
+            assert webhook.accept({'update_id': update_id}) == 200
+        wait_until(lambda: len(handled) == 200)
+        assert [update_id for update_id in handled if update_id % 2] == list(range(1, 200, 2))
+        assert [update_id for update_id in handled if not update_id % 2] == list(range(0, 200, 2))
+    finally:
+        webhook.httpd.server_close()
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from treasury import Treasury
+
+THREADS = 16
+PER_THREAD = 200
+
+
+class AtomicCollection:
+    """ A mongomock collection whose operations are atomic, as single-document writes are in MongoDB.
+    mongomock alone applies a racing upsert or $inc twice or not at all """
+    def __init__(self, collection):
+        self.collection = collection
+        self._lock = threading.Lock()
+
+    def update_one(self, *args, **kwargs):
+        with self._lock:
+            return self.collection.update_one(*args, **kwargs)
+
+    def aggregate(self, pipeline):
+        with self._lock:
+            return iter(list(self.collection.aggregate(pipeline)))
+
+    def count_documents(self, filter):
+        with self._lock:
+            return self.collection.count_documents(filter)
+
+
+@pytest.fixture
+def treasury(database):
+    database.users_collection.insert_one({'user_id': Treasury.ACCOUNT, 'nickname': '@budget', 'coins': 1000})
+    treasury = database.treasury
+    treasury.stripes = 4
+    treasury.collection = AtomicCollection(treasury.collection)
+    return treasury
+
+
+def recorded(treasury):
+    """ Coins the ledger recorded for the budget account """
+    treasury.database.ledger.flush()
+    return sum(entry['delta']['coins'] for entry in treasury.database.ledger.entries.find({'user_id': Treasury.ACCOUNT}))
+
+
+def test_concurrent_adds_lose_nothing(treasury):
+    totals = []
+    done = threading.Event()
+
+    def add():
+        for _ in range(PER_THREAD):
+            treasury.add(1, 'fee')
+
+    def watch():
+        while not done.is_set():
+            totals.append(treasury.total())
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        for future in [pool.submit(add) for _ in range(THREADS)]:
+            future.result()
+    done.set()
+    watcher.join()
+
+    expected = THREADS * PER_THREAD
+    assert treasury.total() == 1000 + expected
+    assert recorded(treasury) == expected
+    # Readers racing the writers never see coins that were not added
+    assert totals and all(1000 <= total <= 1000 + expected for total in totals)
+    assert treasury.collection.count_documents({}) <= treasury.stripes
+
+
+def test_spending_and_income_net_out(treasury):
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        for future in [pool.submit(treasury.add, 5 if index % 2 else -5, 'mixed') for index in range(THREADS * 50)]:
+            future.result()
+    assert treasury.total() == 1000
+    assert recorded(treasury) == 0